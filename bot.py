@@ -1,19 +1,29 @@
 import os
 import asyncio
+import functools
+import hmac
+import heapq
+import itertools
+import json
 import logging
 import aiohttp
 import aiosqlite
 import random
+import signal
+import socket
 import time
-from datetime import datetime, timedelta, date
+from datetime import datetime, timedelta, timezone, date
 from aiohttp import web
 from urllib.parse import quote
 from collections import OrderedDict
+from typing import NamedTuple, Optional
+from contextlib import asynccontextmanager
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (
-    Application, CommandHandler, CallbackQueryHandler, MessageHandler,
+    Application, BaseUpdateProcessor, CommandHandler, CallbackQueryHandler, MessageHandler,
     filters, ContextTypes, ConversationHandler
 )
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter
 from telegram.helpers import escape_markdown
 
 # ---------- SOZLAMALAR ----------
@@ -41,57 +51,789 @@ REFERRAL_BONUS = 2000
 MIN_WITHDRAW = 50000
 MAX_WITHDRAW_DAILY = 1
 AISPORTS_BONUS = 30000
+AISPORTS_DELAY = (60, 120)         # bonus /start dan shuncha soniya keyin beriladi
+AISPORTS_BATCH_SIZE = 500
+
+# ========== HTTP SESSION ==========
+HTTP_TIMEOUT = aiohttp.ClientTimeout(total=20, connect=5)
+http_session = None
+
+async def open_http_session() -> aiohttp.ClientSession:
+    """football-data.org uchun yagona (keep-alive, DNS kesh) ClientSession."""
+    global http_session
+    if http_session is None or http_session.closed:
+        connector = aiohttp.TCPConnector(limit=10, limit_per_host=5, ttl_dns_cache=300, keepalive_timeout=60)
+        http_session = aiohttp.ClientSession(connector=connector, timeout=HTTP_TIMEOUT)
+    return http_session
+
+async def close_http_session():
+    global http_session
+    if http_session is not None and not http_session.closed:
+        await http_session.close()
+    http_session = None
+
+# ========== COORDINATION ==========
+# Bir nechta worker (dyno/jarayon) uchun umumiy holat: liderlik lease'i, football-data kvotasi
+# va keshlarni yangilash hodisalari. Standart backend – SQLite fayl qulfi (bitta host),
+# COORDINATION_BACKEND=redis bo'lsa Redis (yoki Redis-mos server, REDIS_URL).
+COORDINATION_BACKEND = os.environ.get("COORDINATION_BACKEND", "sqlite")
+COORDINATION_PATH = os.environ.get("COORDINATION_PATH", "data/coord.db")
+REDIS_URL = os.environ.get("REDIS_URL", "redis://localhost:6379/0")
+WORKER_ID = os.environ.get("WORKER_ID") or f"{socket.gethostname()}-{os.getpid()}"
+LEADER_LEASE_TTL = 15
+COORD_EVENT_INTERVAL = 1.0
+COORD_EVENT_RETENTION = 10 * 60
+COORD_EVENT_BATCH = 500
+
+class SQLiteCoordination:
+    """Alohida SQLite fayl; BEGIN IMMEDIATE jarayonlar orasida atomiklikni ta'minlaydi."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._db = None
+        self._lock = asyncio.Lock()
+        self._pruned_at = 0.0
+
+    async def open(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._db = await aiosqlite.connect(self.path, isolation_level=None)
+        await self._db.execute("PRAGMA journal_mode=WAL")
+        await self._db.execute("PRAGMA busy_timeout=5000")
+        await self._db.execute("CREATE TABLE IF NOT EXISTS leases (name TEXT PRIMARY KEY, owner TEXT NOT NULL, expires_at REAL NOT NULL)")
+        await self._db.execute("CREATE TABLE IF NOT EXISTS rate_buckets (name TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL)")
+        await self._db.execute("""CREATE TABLE IF NOT EXISTS events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, channel TEXT NOT NULL, origin TEXT NOT NULL,
+            payload TEXT NOT NULL, created_at REAL NOT NULL)""")
+        await self._db.execute("CREATE INDEX IF NOT EXISTS idx_events_created ON events(created_at)")
+
+    async def close(self):
+        if self._db is not None:
+            await self._db.close()
+            self._db = None
+
+    @asynccontextmanager
+    async def _tx(self):
+        async with self._lock:
+            await self._db.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._db
+            except BaseException:
+                await self._db.execute("ROLLBACK")
+                raise
+            await self._db.execute("COMMIT")
 
-# ========== API RATE LIMIT ==========
-API_SEMAPHORE = asyncio.Semaphore(1)
-API_LAST_CALL = 0
-API_MIN_INTERVAL = 6
+    async def try_lease(self, name: str, owner: str, ttl: float) -> bool:
+        now = time.time()
+        async with self._tx() as db:
+            await db.execute("""INSERT INTO leases (name, owner, expires_at) VALUES (?, ?, ?)
+                ON CONFLICT(name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at
+                WHERE leases.owner = excluded.owner OR leases.expires_at < ?""", (name, owner, now + ttl, now))
+            async with db.execute("SELECT owner FROM leases WHERE name = ?", (name,)) as cur:
+                return (await cur.fetchone())[0] == owner
+
+    async def release_lease(self, name: str, owner: str):
+        async with self._tx() as db:
+            await db.execute("DELETE FROM leases WHERE name = ? AND owner = ?", (name, owner))
+
+    async def bucket(self, name: str, rate: float, capacity: float, ceiling: float = None) -> float:
+        """ceiling=None – bitta token olish (kutish soniyasini qaytaradi), aks holda tokenlarni ceiling gacha kesish."""
+        now = time.time()
+        async with self._tx() as db:
+            async with db.execute("SELECT tokens, updated_at FROM rate_buckets WHERE name = ?", (name,)) as cur:
+                row = await cur.fetchone()
+            tokens = capacity if row is None else min(capacity, row[0] + (now - row[1]) * rate)
+            wait = 0.0
+            if ceiling is not None:
+                tokens = min(tokens, ceiling)
+            elif tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / rate
+            await db.execute("INSERT OR REPLACE INTO rate_buckets (name, tokens, updated_at) VALUES (?, ?, ?)",
+                             (name, tokens, now))
+        return wait
 
-async def rate_limited_api_call(url, headers, params=None):
-    global API_LAST_CALL
-    async with API_SEMAPHORE:
+    async def publish(self, events):
         now = time.time()
-        if now - API_LAST_CALL < API_MIN_INTERVAL:
-            await asyncio.sleep(API_MIN_INTERVAL - (now - API_LAST_CALL))
-        for attempt in range(3):
+        async with self._tx() as db:
+            await db.executemany("INSERT INTO events (channel, origin, payload, created_at) VALUES (?, ?, ?, ?)",
+                                 [(channel, origin, payload, now) for channel, origin, payload in events])
+            if now - self._pruned_at > 60:
+                await db.execute("DELETE FROM events WHERE created_at < ?", (now - COORD_EVENT_RETENTION,))
+                self._pruned_at = now
+
+    async def poll(self, cursor):
+        """(yangi_cursor, [(channel, origin, payload), ...]); cursor=None – faqat hozirgi oxirgi id."""
+        async with self._lock:
+            if cursor is None:
+                async with self._db.execute("SELECT COALESCE(MAX(id), 0) FROM events") as cur:
+                    return (await cur.fetchone())[0], []
+            async with self._db.execute("SELECT id, channel, origin, payload FROM events WHERE id > ? ORDER BY id LIMIT ?",
+                                        (cursor, COORD_EVENT_BATCH)) as cur:
+                rows = await cur.fetchall()
+        if rows:
+            cursor = rows[-1][0]
+        return cursor, [r[1:] for r in rows]
+
+class RedisCoordination:
+    """Redis (yoki Redis-mos server) orqali: lease – SET PX, kvota – Lua token-bucket, hodisalar – stream."""
+
+    PREFIX = "litebot:"
+    LEASE_LUA = """
+        local cur = redis.call('GET', KEYS[1])
+        if cur == false or cur == ARGV[1] then
+            redis.call('SET', KEYS[1], ARGV[1], 'PX', ARGV[2])
+            return 1
+        end
+        return 0"""
+    RELEASE_LUA = """
+        if redis.call('GET', KEYS[1]) == ARGV[1] then return redis.call('DEL', KEYS[1]) end
+        return 0"""
+    BUCKET_LUA = """
+        local t = redis.call('TIME')
+        local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+        local rate, capacity = tonumber(ARGV[1]), tonumber(ARGV[2])
+        local b = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+        local tokens = tonumber(b[1]) or capacity
+        local updated = tonumber(b[2]) or now
+        tokens = math.min(capacity, tokens + (now - updated) * rate)
+        local wait = 0
+        if ARGV[3] ~= '' then
+            tokens = math.min(tokens, tonumber(ARGV[3]))
+        elseif tokens >= 1 then
+            tokens = tokens - 1
+        else
+            wait = (1 - tokens) / rate
+        end
+        redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated', now)
+        redis.call('EXPIRE', KEYS[1], 3600)
+        return tostring(wait)"""
+
+    def __init__(self, url: str):
+        self.url = url
+        self._redis = None
+
+    async def open(self):
+        try:
+            import redis.asyncio as aioredis
+        except ImportError:
+            raise RuntimeError("COORDINATION_BACKEND=redis uchun `redis` paketi o'rnatilmagan")
+        self._redis = aioredis.from_url(self.url, decode_responses=True)
+        await self._redis.ping()
+        self._lease = self._redis.register_script(self.LEASE_LUA)
+        self._release = self._redis.register_script(self.RELEASE_LUA)
+        self._bucket = self._redis.register_script(self.BUCKET_LUA)
+
+    async def close(self):
+        if self._redis is not None:
+            await self._redis.aclose()
+            self._redis = None
+
+    async def try_lease(self, name: str, owner: str, ttl: float) -> bool:
+        return bool(await self._lease(keys=[self.PREFIX + "lease:" + name], args=[owner, int(ttl * 1000)]))
+
+    async def release_lease(self, name: str, owner: str):
+        await self._release(keys=[self.PREFIX + "lease:" + name], args=[owner])
+
+    async def bucket(self, name: str, rate: float, capacity: float, ceiling: float = None) -> float:
+        wait = await self._bucket(keys=[self.PREFIX + "bucket:" + name],
+                                  args=[rate, capacity, "" if ceiling is None else ceiling])
+        return float(wait)
+
+    async def publish(self, events):
+        async with self._redis.pipeline(transaction=False) as pipe:
+            for channel, origin, payload in events:
+                pipe.xadd(self.PREFIX + "events", {"channel": channel, "origin": origin, "payload": payload},
+                          maxlen=10000, approximate=True)
+            await pipe.execute()
+
+    async def poll(self, cursor):
+        stream = self.PREFIX + "events"
+        if cursor is None:
+            last = await self._redis.xrevrange(stream, count=1)
+            return (last[0][0] if last else "0-0"), []
+        res = await self._redis.xread({stream: cursor}, count=COORD_EVENT_BATCH)
+        events = []
+        for _, entries in res:
+            for entry_id, fields in entries:
+                cursor = entry_id
+                events.append((fields["channel"], fields["origin"], fields["payload"]))
+        return cursor, events
+
+class Coordinator:
+    """Workerlar orasida liderlik, umumiy API kvotasi va hodisalar (kesh invalidatsiyasi)."""
+
+    def __init__(self, backend, worker_id: str):
+        self.backend = backend
+        self.worker_id = worker_id
+        self.is_leader = False
+        self._handlers = {}
+        self._outgoing = []
+        self._cursor = None
+
+    async def open(self):
+        await self.backend.open()
+        self._cursor, _ = await self.backend.poll(None)
+
+    async def close(self):
+        try:
+            await self._flush()
+            if self.is_leader:
+                await self.backend.release_lease("leader", self.worker_id)
+        except Exception as e:
+            logger.error(f"Coordinator yopishda xato: {e}")
+        self.is_leader = False
+        await self.backend.close()
+
+    # ---------- API kvotasi ----------
+    async def take_token(self, bucket: str, rate: float, capacity: float) -> float:
+        try:
+            return await self.backend.bucket(bucket, rate, capacity)
+        except Exception as e:
+            # Backend ishlamasa faqat mahalliy limiterga tayanamiz
+            logger.warning(f"Umumiy kvota olinmadi ({bucket}): {e}")
+            return 0.0
+
+    async def clamp_tokens(self, bucket: str, rate: float, capacity: float, ceiling: float):
+        try:
+            await self.backend.bucket(bucket, rate, capacity, ceiling)
+        except Exception as e:
+            logger.warning(f"Umumiy kvota yangilanmadi ({bucket}): {e}")
+
+    # ---------- hodisalar ----------
+    def on(self, channel: str, handler):
+        """handler – async handler(payload: dict); boshqa workerlar e'lon qilgan hodisalar uchun."""
+        self._handlers[channel] = handler
+
+    def publish(self, channel: str, payload: dict):
+        self._outgoing.append((channel, self.worker_id, json.dumps(payload, ensure_ascii=False)))
+
+    async def _flush(self):
+        if not self._outgoing:
+            return
+        batch, self._outgoing = self._outgoing, []
+        try:
+            await self.backend.publish(batch)
+        except BaseException:
+            self._outgoing[:0] = batch
+            raise
+
+    async def _sync_events(self):
+        await self._flush()
+        while True:
+            self._cursor, events = await self.backend.poll(self._cursor)
+            for channel, origin, payload in events:
+                handler = self._handlers.get(channel)
+                if origin == self.worker_id or handler is None:
+                    continue
+                try:
+                    await handler(json.loads(payload))
+                except Exception as e:
+                    logger.exception(f"Hodisa xatosi ({channel}): {e}")
+            if len(events) < COORD_EVENT_BATCH:
+                return
+
+    async def run_events(self):
+        while True:
             try:
-                async with aiohttp.ClientSession() as session:
-                    async with session.get(url, headers=headers, params=params) as resp:
-                        API_LAST_CALL = time.time()
-                        if resp.status == 200:
-                            return {"success": await resp.json()}
-                        elif resp.status == 429:
-                            await asyncio.sleep(2 ** attempt + random.uniform(1, 3))
-                        else:
-                            return {"error": f"❌ API xatolik: {resp.status}"}
+                await self._sync_events()
             except Exception as e:
-                logger.error(f"API call xatosi (urinish {attempt+1}): {e}")
-                await asyncio.sleep(2 ** attempt)
-        return {"error": "❌ API ga bogʻlanib boʻlmadi"}
-
-# ========== MATCH CACHE (10 daqiqa) ==========
-match_cache = OrderedDict()
-CACHE_TTL = 600
-
-async def get_cached_match(match_id: int):
-    now = time.time()
-    if match_id in match_cache:
-        data, ts = match_cache[match_id]
-        if now - ts < CACHE_TTL:
-            return data
-        del match_cache[match_id]
-    url = f"{FOOTBALL_DATA_URL}/matches/{match_id}"
-    headers = {"X-Auth-Token": FOOTBALL_DATA_KEY}
-    result = await rate_limited_api_call(url, headers)
-    if "success" in result:
-        match_cache[match_id] = (result["success"], now)
-        return result["success"]
-    return None
+                logger.error(f"Coordinator hodisalari xatosi: {e}")
+            await asyncio.sleep(COORD_EVENT_INTERVAL)
+
+    # ---------- liderlik ----------
+    async def lead(self, services: dict):
+        """Lease'ni ushlagan worker services ni ishlatadi; lease yo'qolsa ularni to'xtatadi."""
+        tasks = []
+        try:
+            while True:
+                try:
+                    leader = await self.backend.try_lease("leader", self.worker_id, LEADER_LEASE_TTL)
+                except Exception as e:
+                    logger.error(f"Leader lease yangilanmadi: {e}")
+                    leader = False
+                if leader and not tasks:
+                    self.is_leader = True
+                    logger.info(f"👑 {self.worker_id} leader bo'ldi")
+                    tasks = [asyncio.create_task(supervised(name, factory)) for name, factory in services.items()]
+                elif not leader and tasks:
+                    logger.warning(f"{self.worker_id} leaderlikni yo'qotdi, leader servislari to'xtatilmoqda")
+                    for task in tasks:
+                        task.cancel()
+                    await asyncio.gather(*tasks, return_exceptions=True)
+                    tasks = []
+                self.is_leader = leader
+                await asyncio.sleep(LEADER_LEASE_TTL / 3)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+def make_coordination_backend():
+    if COORDINATION_BACKEND == "redis":
+        return RedisCoordination(REDIS_URL)
+    if COORDINATION_BACKEND != "sqlite":
+        raise RuntimeError(f"Noma'lum COORDINATION_BACKEND: {COORDINATION_BACKEND}")
+    return SQLiteCoordination(COORDINATION_PATH)
+
+coordinator = Coordinator(make_coordination_backend(), WORKER_ID)
+
+# ========== API RATE LIMIT ==========
+API_REQUESTS_PER_MINUTE = int(os.environ.get("API_REQUESTS_PER_MINUTE", 10))
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 1
+
+class ApiRateLimiter:
+    """football-data.org minutlik kvotasi uchun token-bucket.
+
+    Kvota doirasida portlashga ruxsat beradi, javob sarlavhalaridan qolgan kvotani o'qiydi
+    va interaktiv so'rovlarni fon (prefetch) so'rovlaridan oldin o'tkazadi. Kvota barcha
+    workerlar uchun umumiy: navbat boshidagi so'rov coordinator dagi bucket'dan ham token oladi.
+    """
+
+    def __init__(self, per_minute: int, bucket: str = "football-data"):
+        self.bucket = bucket
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._waiters = []  # heap: (priority, seq)
+        self._seq = itertools.count()
+        self._cond = asyncio.Condition()
+        self.acquired = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _delay(self) -> float:
+        now = time.monotonic()
+        if now < self._blocked_until:
+            return self._blocked_until - now
+        self._refill()
+        if self._tokens >= 1:
+            return 0.0
+        return (1 - self._tokens) / self.rate
+
+    async def acquire(self, priority: int = PRIORITY_INTERACTIVE):
+        started = time.monotonic()
+        entry = (priority, next(self._seq))
+        async with self._cond:
+            heapq.heappush(self._waiters, entry)
+            try:
+                while True:
+                    delay = None
+                    if self._waiters[0] == entry:
+                        delay = self._delay()
+                        if delay <= 0:
+                            delay = await coordinator.take_token(self.bucket, self.rate, self.capacity)
+                        if delay <= 0:
+                            self._tokens -= 1
+                            heapq.heappop(self._waiters)
+                            break
+                        if self._delay() <= 0:
+                            # Umumiy kvota tugagan: navbat boshini shu vaqtgacha to'xtatamiz
+                            self._blocked_until = time.monotonic() + delay
+                    try:
+                        await asyncio.wait_for(self._cond.wait(), delay)
+                    except asyncio.TimeoutError:
+                        pass
+            except BaseException:
+                if entry in self._waiters:
+                    self._waiters.remove(entry)
+                    heapq.heapify(self._waiters)
+                raise
+            finally:
+                self._cond.notify_all()
+        waited = time.monotonic() - started
+        self.acquired += 1
+        self.total_wait += waited
+        self.max_wait = max(self.max_wait, waited)
+
+    async def block(self, seconds: float):
+        self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+        # Boshqa workerlar ham shuncha kutishi uchun umumiy bucket'ni manfiyga tushiramiz
+        await coordinator.clamp_tokens(self.bucket, self.rate, self.capacity, 1 - seconds * self.rate)
+
+    async def update_from_headers(self, headers):
+        """X-Requests-Available-Minute / X-RequestCounter-Reset bo'yicha moslashish."""
+        try:
+            available = headers.get("X-Requests-Available-Minute")
+            reset = headers.get("X-RequestCounter-Reset")
+            available = int(available) if available is not None else None
+            reset = float(reset) if reset is not None else None
+        except ValueError:
+            return
+        if available is None:
+            return
+        self._refill()
+        self._tokens = min(self._tokens, float(available))
+        if available <= 0 and reset is not None:
+            await self.block(reset)
+        else:
+            await coordinator.clamp_tokens(self.bucket, self.rate, self.capacity, float(available))
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": len(self._waiters),
+            "acquired": self.acquired,
+            "avg_wait": self.total_wait / self.acquired if self.acquired else 0.0,
+            "max_wait": self.max_wait,
+        }
+
+api_limiter = ApiRateLimiter(API_REQUESTS_PER_MINUTE)
+
+async def rate_limited_api_call(url, headers, params=None, priority=PRIORITY_INTERACTIVE):
+    session = await open_http_session()
+    for attempt in range(3):
+        await api_limiter.acquire(priority)
+        try:
+            async with session.get(url, headers=headers, params=params) as resp:
+                await api_limiter.update_from_headers(resp.headers)
+                if resp.status == 200:
+                    return {"success": await resp.json()}
+                elif resp.status == 429:
+                    if "X-RequestCounter-Reset" not in resp.headers:
+                        await api_limiter.block(2 ** attempt + random.uniform(1, 3))
+                else:
+                    return {"error": f"❌ API xatolik: {resp.status}"}
+        except Exception as e:
+            logger.error(f"API call xatosi (urinish {attempt+1}): {e}")
+            await asyncio.sleep(2 ** attempt)
+    return {"error": "❌ API ga bogʻlanib boʻlmadi"}
+
+# ========== SINGLE-FLIGHT ==========
+class SingleFlight:
+    """Bir xil kalit bo'yicha parallel chaqiruvlarni bitta bajarilishga birlashtiradi."""
+
+    def __init__(self):
+        self._inflight = {}
+
+    async def do(self, key, fn):
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._inflight.pop(key, None) if self._inflight.get(key) is t else None)
+        # Bitta kutuvchi bekor qilinsa ham umumiy so'rov davom etadi
+        return await asyncio.shield(task)
+
+api_flight = SingleFlight()
+
+# ========== MATCH CACHE ==========
+MATCH_CACHE_MAX_ENTRIES = 2000
+MATCH_TTL_DEFAULT = 600
+MATCH_TTL_BY_STATUS = {
+    "FINISHED": 6 * 3600,
+    "AWARDED": 6 * 3600,
+    "CANCELLED": 6 * 3600,
+    "POSTPONED": 3600,
+    "IN_PLAY": 60,
+    "LIVE": 60,
+    "PAUSED": 60,
+}
+MATCH_STALE_MAX = 24 * 3600  # bundan eski nusxa foydalanuvchiga ko'rsatilmaydi
+
+MATCH_UPSERT_SQL = """INSERT INTO matches (match_id, status, payload, fetched_at, detail_at) VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT(match_id) DO UPDATE SET status = excluded.status, payload = excluded.payload,
+        fetched_at = excluded.fetched_at, detail_at = excluded.detail_at
+    WHERE excluded.fetched_at >= matches.fetched_at"""
+
+class MatchCache:
+    """LRU + holatga qarab TTL + stale-while-revalidate match keshi.
+
+    L1 – xotiradagi LRU, L2 – data/bot.db dagi `matches` jadvali (restartdan keyin ham qoladi).
+    Ro'yxat so'rovlari (/matches?ids=, liga o'yinlari) qisqa shaklni qaytaradi – tarkib, murabbiy,
+    stadion yo'q. Shuning uchun har yozuvda detail_at saqlanadi: oxirgi /matches/{id} vaqti yoki None.
+    """
+
+    def __init__(self, max_entries: int = MATCH_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._data = OrderedDict()  # match_id -> (match, fetched_at, detail_at)
+        self._background = set()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def ttl_for(match: dict) -> int:
+        return MATCH_TTL_BY_STATUS.get(match.get("status"), MATCH_TTL_DEFAULT)
+
+    def prime(self, match_id: int, match: dict, fetched_at: float):
+        """Liga ro'yxatidan faqat L1 dagi bo'sh joyni to'ldiradi.
+
+        Mavjud (to'liq) yozuv almashtirilmaydi; L2, hodisa va ko'rinish keshiga tegilmaydi –
+        snapshotning o'zi league_fixtures jadvalida saqlanadi.
+        """
+        if match_id not in self._data:
+            self._put(match_id, match, fetched_at)
+
+    def _put(self, match_id: int, match: dict, fetched_at: float, detail_at: float = None):
+        self._data[match_id] = (match, fetched_at, detail_at)
+        self._data.move_to_end(match_id)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def _store(self, match_id: int, match: dict, fetched_at: float, detail_at: float):
+        self._put(match_id, match, fetched_at, detail_at)
+        invalidate_match_view(match_id, publish=False)
+        db_writer.add_nowait(MATCH_UPSERT_SQL, (match_id, match.get("status"),
+                                                json.dumps(match, ensure_ascii=False), fetched_at, detail_at))
+        coordinator.publish("match", {"id": match_id, "match": match, "fetched_at": fetched_at,
+                                      "detail_at": detail_at})
+
+    def set(self, match_id: int, match: dict, fetched_at: float = None):
+        """/matches/{id} ning to'liq javobini saqlaydi."""
+        fetched_at = fetched_at or time.time()
+        self._store(match_id, match, fetched_at, fetched_at)
+
+    async def merge_summary(self, match_id: int, summary: dict, fetched_at: float = None):
+        """Ro'yxatdagi qisqa shaklni mavjud to'liq yozuv ustiga qo'shadi (tarkib va h.k. saqlanadi).
+
+        L1 da bo'lmasa L2 dagi qator o'qiladi – aks holda upsert undagi to'liq nusxani almashtiradi.
+        """
+        fetched_at = fetched_at or time.time()
+        entry = self._data.get(match_id)
+        if entry is None:
+            entry = await self._load_l2(match_id)
+        if entry is None or entry[2] is None:
+            self._store(match_id, summary, fetched_at, None)
+            return
+        match = {**entry[0], **summary}
+        for side in ("homeTeam", "awayTeam"):
+            match[side] = {**entry[0].get(side, {}), **summary.get(side, {})}
+        self._store(match_id, match, fetched_at, entry[2])
+
+    async def apply_remote(self, payload: dict):
+        """Boshqa worker olgan yangiroq nusxani L1 ga qo'yadi (L2 ga u allaqachon yozgan)."""
+        match_id, fetched_at = payload["id"], payload["fetched_at"]
+        entry = self._data.get(match_id)
+        if entry is None or entry[1] < fetched_at:
+            self._put(match_id, payload["match"], fetched_at, payload.get("detail_at"))
+            invalidate_match_view(match_id, publish=False)
+
+    def expires_at(self, match_id: int) -> float:
+        """To'liq (detailed) nusxa muddati tugaydigan vaqt; yozuv bo'lmasa 0."""
+        entry = self._data.get(match_id)
+        if entry is None or entry[2] is None:
+            return 0.0
+        return entry[2] + self.ttl_for(entry[0])
+
+    def needs_refresh(self, match_id: int) -> bool:
+        entry = self._data.get(match_id)
+        return entry is None or time.time() - entry[1] >= self.ttl_for(entry[0])
+
+    async def _load_l2(self, match_id: int):
+        async with db_pool.read() as db:
+            async with db.execute("SELECT payload, fetched_at, detail_at FROM matches WHERE match_id = ? AND fetched_at > ?",
+                                  (match_id, time.time() - MATCH_STALE_MAX)) as cur:
+                row = await cur.fetchone()
+        if not row:
+            return None
+        entry = (json.loads(row[0]), row[1], row[2])
+        self._put(match_id, *entry)
+        return entry
+
+    async def warm(self):
+        """Startda L2 dagi eng yangi yozuvlarni L1 ga yuklaydi, muddati o'tganlarini o'chiradi."""
+        cutoff = time.time() - MATCH_STALE_MAX
+        async with db_pool.write() as db:
+            await db.execute("DELETE FROM matches WHERE fetched_at <= ?", (cutoff,))
+        async with db_pool.read() as db:
+            async with db.execute("SELECT match_id, payload, fetched_at, detail_at FROM matches ORDER BY fetched_at DESC LIMIT ?",
+                                  (self.max_entries,)) as cur:
+                rows = await cur.fetchall()
+        for match_id, payload, fetched_at, detail_at in reversed(rows):
+            self._put(match_id, json.loads(payload), fetched_at, detail_at)
+        logger.info(f"Match kesh L2 dan isitildi: {len(rows)} ta")
+
+    async def _load(self, match_id: int, priority: int):
+        url = f"{FOOTBALL_DATA_URL}/matches/{match_id}"
+        result = await rate_limited_api_call(url, HEADERS, priority=priority)
+        if "success" in result:
+            self.set(match_id, result["success"])
+            return result["success"]
+        return None
+
+    def _revalidate(self, match_id: int):
+        task = asyncio.ensure_future(
+            api_flight.do(("match", match_id), lambda: self._load(match_id, PRIORITY_BACKGROUND)))
+        self._background.add(task)
+
+        def done(t):
+            self._background.discard(t)
+            if not t.cancelled() and t.exception():
+                logger.error(f"Match {match_id} fon yangilanishi xatosi: {t.exception()}")
+        task.add_done_callback(done)
+
+    async def get(self, match_id: int, detailed: bool = False, allow_stale: bool = True):
+        """detailed=True – tarkib kerak: qisqa yozuv keshda bo'lsa ham /matches/{id} olinadi.
+
+        allow_stale=False – muddati o'tgan nusxa qaytarilmaydi, yangisi kutiladi.
+        """
+        entry = self._data.get(match_id)
+        if entry is None:
+            entry = await self._load_l2(match_id)
+        if entry and (entry[2] is not None or not detailed):
+            match, fetched_at, detail_at = entry
+            self._data.move_to_end(match_id)
+            age = time.time() - (detail_at if detailed else fetched_at)
+            if age < self.ttl_for(match):
+                self.hits += 1
+                return match
+            if allow_stale and age < MATCH_STALE_MAX:
+                # Eski nusxani darhol qaytarib, fonda yangilash
+                self.stale_hits += 1
+                self._revalidate(match_id)
+                return match
+        self.misses += 1
+        return await api_flight.do(("match", match_id), lambda: self._load(match_id, PRIORITY_INTERACTIVE))
+
+    def stats(self) -> dict:
+        return {"size": len(self._data), "hits": self.hits, "stale_hits": self.stale_hits,
+                "misses": self.misses, "evictions": self.evictions}
+
+match_cache = MatchCache()
+
+async def get_cached_match(match_id: int, detailed: bool = False, allow_stale: bool = True):
+    return await match_cache.get(match_id, detailed, allow_stale)
+
+# ========== DATABASE POOL ==========
+DB_READERS = int(os.environ.get("DB_READERS", 4))
+DB_PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA cache_size = -16000",
+    "PRAGMA mmap_size = 134217728",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA busy_timeout = 5000",
+)
+
+class DBPool:
+    """Bitta yozuvchi va bir nechta o'quvchi doimiy aiosqlite ulanishi (WAL rejimida)."""
+
+    def __init__(self, path: str, readers: int = DB_READERS):
+        self.path = path
+        self.readers = readers
+        self._writer = None
+        self._write_lock = asyncio.Lock()
+        self._idle = None
+        self._all_readers = []
+
+    async def _connect(self):
+        db = await aiosqlite.connect(self.path)
+        for pragma in DB_PRAGMAS:
+            await db.execute(pragma)
+        return db
+
+    async def open(self):
+        if self._writer is not None:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        # WAL rejimini yozuvchi ulanish birinchi o'rnatadi
+        self._writer = await self._connect()
+        self._idle = asyncio.Queue()
+        for _ in range(self.readers):
+            db = await self._connect()
+            self._all_readers.append(db)
+            self._idle.put_nowait(db)
+        logger.info(f"DB pool ochildi: 1 yozuvchi, {self.readers} o'quvchi ({self.path})")
+
+    async def close(self):
+        if self._writer is None:
+            return
+        async with self._write_lock:
+            for db in self._all_readers:
+                await db.close()
+            self._all_readers = []
+            await self._writer.close()
+            self._writer = None
+        logger.info("DB pool yopildi")
+
+    @asynccontextmanager
+    async def read(self):
+        db = await self._idle.get()
+        try:
+            yield db
+        finally:
+            self._idle.put_nowait(db)
+
+    @asynccontextmanager
+    async def write(self):
+        """Yozuvchi ulanish; blok muvaffaqiyatli tugasa commit, xatoda rollback."""
+        async with self._write_lock:
+            try:
+                yield self._writer
+            except BaseException:
+                await self._writer.rollback()
+                raise
+            else:
+                await self._writer.commit()
+
+db_pool = DBPool(DB_PATH)
+
+# ========== BATCH WRITER ==========
+WRITE_FLUSH_INTERVAL = 5
+WRITE_BATCH_SIZE = 500
+
+class BatchWriter:
+    """Yozuvlarni to'plab, bitta tranzaksiyada executemany bilan yozadi."""
+
+    def __init__(self, pool: DBPool, flush_interval: float = WRITE_FLUSH_INTERVAL, max_pending: int = WRITE_BATCH_SIZE):
+        self.pool = pool
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._pending = {}  # sql -> [params, ...]
+        self._count = 0
+        self._flush_lock = asyncio.Lock()
+
+    def add_nowait(self, sql: str, params):
+        """Navbatga qo'shadi; diskka davriy flush (run) yoki keyingi flush yozadi."""
+        self._pending.setdefault(sql, []).append(params)
+        self._count += 1
+
+    async def add(self, sql: str, params):
+        self.add_nowait(sql, params)
+        if self._count >= self.max_pending:
+            await self.flush()
+
+    async def flush(self):
+        async with self._flush_lock:
+            if not self._pending:
+                return
+            pending, self._pending, self._count = self._pending, {}, 0
+            try:
+                async with self.pool.write() as db:
+                    for sql, rows in pending.items():
+                        await db.executemany(sql, rows)
+            except Exception:
+                # Yozilmagan qatorlarni keyingi flush uchun qaytarish
+                for sql, rows in pending.items():
+                    self._pending[sql] = rows + self._pending.get(sql, [])
+                    self._count += len(rows)
+                raise
+
+    async def run(self):
+        """Har flush_interval soniyada to'plangan yozuvlarni diskka tushiradi."""
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"BatchWriter flush xatosi: {e}")
+
+db_writer = BatchWriter(db_pool)
 
 # ========== DATABASE ==========
 async def init_db():
-    os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
-    async with aiosqlite.connect(DB_PATH) as db:
+    await db_pool.open()
+    async with db_pool.write() as db:
         # Adminlar
         await db.execute("""
             CREATE TABLE IF NOT EXISTS admins (
@@ -153,6 +895,8 @@ async def init_db():
                 daily_withdraw_date TEXT,
                 aisports_bonus_received INTEGER DEFAULT 0,
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                is_active INTEGER DEFAULT 1,
+                blocked_at TIMESTAMP,
                 FOREIGN KEY (referrer_id) REFERENCES users(user_id)
             )
         """)
@@ -177,6 +921,57 @@ async def init_db():
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
             )
         """)
+        # Yuboriladigan xabarlar navbati (outbox)
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                chat_id INTEGER NOT NULL,
+                text TEXT,
+                parse_mode TEXT,
+                reply_markup TEXT,
+                media_type TEXT,
+                media_file_id TEXT,
+                disable_preview INTEGER DEFAULT 0,
+                attempts INTEGER DEFAULT 0,
+                next_attempt_at REAL DEFAULT 0,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox(next_attempt_at, id)")
+        # Match ma'lumotlari (match_cache L2)
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS matches (
+                match_id INTEGER PRIMARY KEY,
+                status TEXT,
+                payload TEXT NOT NULL,
+                fetched_at REAL NOT NULL,
+                detail_at REAL
+            )
+        """)
+        # Liga o'yinlari snapshoti (prefetcher yozadi)
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS league_fixtures (
+                league_code TEXT PRIMARY KEY,
+                payload TEXT NOT NULL,
+                fetched_at REAL NOT NULL
+            )
+        """)
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                type TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                dedupe_key TEXT UNIQUE,
+                run_at REAL NOT NULL,
+                attempts INTEGER DEFAULT 0,
+                last_error TEXT
+            )
+        """)
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_jobs_due ON jobs(type, run_at)")
+        # Scheduler so'rovlari uchun indekslar
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_subscriptions_time ON subscriptions(match_time)")
+        await db.execute("""CREATE INDEX IF NOT EXISTS idx_subscriptions_match
+            ON subscriptions(match_id, notified_1h, notified_15m, notified_lineups)""")
         # Eski jadvallarga yangi ustunlar qo'shish (agar mavjud bo'lmasa)
         try:
             await db.execute("ALTER TABLE match_analyses ADD COLUMN analysis_url TEXT")
@@ -198,47 +993,92 @@ async def init_db():
             await db.execute("ALTER TABLE users ADD COLUMN aisports_bonus_received INTEGER DEFAULT 0")
         except:
             pass
-        await db.commit()
+        try:
+            await db.execute("ALTER TABLE users ADD COLUMN is_active INTEGER DEFAULT 1")
+        except:
+            pass
+        try:
+            await db.execute("ALTER TABLE users ADD COLUMN blocked_at TIMESTAMP")
+        except:
+            pass
+        try:
+            await db.execute("ALTER TABLE matches ADD COLUMN detail_at REAL")
+        except:
+            pass
 
     # Asosiy adminni qo'shish
     MAIN_ADMIN = 6935090105
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with db_pool.write() as db:
         async with db.execute("SELECT user_id FROM admins WHERE user_id = ?", (MAIN_ADMIN,)) as cur:
             if not await cur.fetchone():
                 await db.execute("INSERT INTO admins (user_id, added_by) VALUES (?, ?)", (MAIN_ADMIN, MAIN_ADMIN))
-                await db.commit()
                 logger.info(f"Asosiy admin qo'shildi: {MAIN_ADMIN}")
+    await load_admin_ids()
 
 # ========== USER FUNCTIONS ==========
 async def get_or_create_user(user_id: int, referrer_id: int = None, bot=None, referred_name=None):
-    async with aiosqlite.connect(DB_PATH) as db:
-        async with db.execute("SELECT * FROM users WHERE user_id = ?", (user_id,)) as cur:
+    # Mavjud foydalanuvchi uchun yozuvchi qulfi olinmaydi
+    async with db_pool.read() as db:
+        async with db.execute("SELECT is_active, * FROM users WHERE user_id = ?", (user_id,)) as cur:
+            row = await cur.fetchone()
+    if row:
+        if not row[0]:
+            return await reactivate_user(user_id)
+        return row[1:]
+    credited = False
+    async with db_pool.write() as db:
+        # Bitta tranzaksiya: referal bonusi faqat INSERT haqiqatan bajarilganda beriladi,
+        # shuning uchun parallel /start lar referrerni ikki marta mukofotlamaydi.
+        async with db.execute(
+            "INSERT INTO users (user_id, referrer_id, aisports_bonus_received) VALUES (?, ?, 0) "
+            "ON CONFLICT(user_id) DO NOTHING RETURNING *", (user_id, referrer_id)) as cur:
             user = await cur.fetchone()
-        if not user:
-            await db.execute("INSERT INTO users (user_id, referrer_id, aisports_bonus_received) VALUES (?, ?, 0)", (user_id, referrer_id))
-            await db.commit()
-            if referrer_id and referrer_id != user_id:
-                async with db.execute("SELECT user_id FROM users WHERE user_id = ?", (referrer_id,)) as cur:
-                    if await cur.fetchone():
-                        await db.execute("UPDATE users SET balance = balance + ?, referral_count = referral_count + 1 WHERE user_id = ?", (REFERRAL_BONUS, referrer_id))
-                        await db.execute("INSERT OR IGNORE INTO referrals (referrer_id, referred_id, bonus) VALUES (?, ?, ?)", (referrer_id, user_id, REFERRAL_BONUS))
-                        await db.commit()
-                        if bot and referred_name:
-                            asyncio.create_task(send_referral_notification(referrer_id, referred_name, REFERRAL_BONUS, bot))
+        if user is None:
             async with db.execute("SELECT * FROM users WHERE user_id = ?", (user_id,)) as cur:
-                user = await cur.fetchone()
+                return await cur.fetchone()
+        if referrer_id and referrer_id != user_id:
+            async with db.execute(
+                "UPDATE users SET balance = balance + ?, referral_count = referral_count + 1 "
+                "WHERE user_id = ? RETURNING user_id", (REFERRAL_BONUS, referrer_id)) as cur:
+                credited = await cur.fetchone() is not None
+            if credited:
+                await db.execute("INSERT OR IGNORE INTO referrals (referrer_id, referred_id, bonus) VALUES (?, ?, ?)", (referrer_id, user_id, REFERRAL_BONUS))
+                if bot and referred_name:
+                    await job_runner.enqueue("referral_notification",
+                        {"referrer_id": referrer_id, "name": referred_name, "bonus": REFERRAL_BONUS}, db=db)
+    if credited:
+        job_runner.notify()
     return user
 
-async def send_referral_notification(referrer_id: int, referred_name: str, bonus: int, bot):
-    try:
-        await bot.send_message(referrer_id,
-            f"🎉 **Tabriklaymiz!**\n\nSizning taklif havolangiz orqali {referred_name} botga qoʻshildi.\n💰 Hisobingizga **{bonus:,} soʻm** bonus qoʻshildi!\n\n📊 Doʻstlaringizni koʻproq taklif qilib pul ishlang.",
-            parse_mode="Markdown")
-    except Exception as e:
-        logger.error(f"Referal xabar yuborilmadi ({referrer_id}): {e}")
+async def deactivate_user(user_id: int, reason: str):
+    """Botni bloklagan / topilmaydigan chatni nofaol qiladi; obunalar va eslatmalar uni chetlab o'tadi.
+
+    BatchWriter orqali emas, darhol yoziladi: aks holda shu oraliqda /start bosgan foydalanuvchini
+    kechikkan flush yana nofaol qilib qo'yadi.
+    """
+    async with db_pool.write() as db:
+        await db.execute("UPDATE users SET is_active = 0, blocked_at = CURRENT_TIMESTAMP WHERE user_id = ? AND is_active = 1",
+                         (user_id,))
+    logger.info(f"Foydalanuvchi nofaol qilindi ({user_id}): {reason}")
+
+async def reactivate_user(user_id: int):
+    """Foydalanuvchini qayta faol qiladi va yangilangan qatorni qaytaradi."""
+    async with db_pool.write() as db:
+        async with db.execute("UPDATE users SET is_active = 1, blocked_at = NULL WHERE user_id = ? RETURNING *",
+                              (user_id,)) as cur:
+            row = await cur.fetchone()
+    logger.info(f"Foydalanuvchi qayta faollashdi ({user_id})")
+    return row
+
+def referral_message(referred_name: str, bonus: int) -> dict:
+    return {"text": f"🎉 **Tabriklaymiz!**\n\nSizning taklif havolangiz orqali {referred_name} botga qoʻshildi.\n💰 Hisobingizga **{bonus:,} soʻm** bonus qoʻshildi!\n\n📊 Doʻstlaringizni koʻproq taklif qilib pul ishlang.",
+            "parse_mode": "Markdown"}
+
+async def referral_notification_job(jobs):
+    await enqueue_messages([(p["referrer_id"], referral_message(p["name"], p["bonus"])) for _, p in jobs])
 
 async def get_user_balance(user_id: int) -> int:
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with db_pool.read() as db:
         async with db.execute("SELECT balance FROM users WHERE user_id = ?", (user_id,)) as cur:
             row = await cur.fetchone()
             return row[0] if row else 0
@@ -248,7 +1088,7 @@ async def can_withdraw(user_id: int):
     if balance < MIN_WITHDRAW:
         return False, f"❌ Minimal yechish miqdori {MIN_WITHDRAW:,} soʻm. Sizda {balance:,} soʻm bor."
     today_str = date.today().isoformat()
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with db_pool.read() as db:
         async with db.execute("SELECT daily_withdraw_date FROM users WHERE user_id = ?", (user_id,)) as cur:
             row = await cur.fetchone()
             if row and row[0] == today_str:
@@ -260,17 +1100,16 @@ async def register_withdraw(user_id: int, amount: int) -> bool:
     if not can: return False
     if amount > await get_user_balance(user_id): return False
     today_str = date.today().isoformat()
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with db_pool.write() as db:
         await db.execute("UPDATE users SET balance = balance - ?, daily_withdraw_date = ? WHERE user_id = ?", (amount, today_str, user_id))
         await db.execute("INSERT INTO withdrawals (user_id, amount, status) VALUES (?, ?, ?)", (user_id, amount, 'completed'))
-        await db.commit()
     return True
 
 async def get_referral_link(user_id: int, bot_username: str) -> str:
     return f"https://t.me/{bot_username}?start=ref_{user_id}"
 
 async def get_referral_stats(user_id: int):
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with db_pool.read() as db:
         async with db.execute("SELECT referral_count FROM users WHERE user_id = ?", (user_id,)) as cur:
             cnt = (await cur.fetchone())[0] or 0
         async with db.execute("SELECT SUM(bonus) FROM referrals WHERE referrer_id = ?", (user_id,)) as cur:
@@ -280,58 +1119,90 @@ async def get_referral_stats(user_id: int):
         return {"count": cnt, "total_bonus": total, "today_count": today}
 
 # ========== AISPORTS BONUS ==========
-async def give_aisports_bonus(user_id: int, bot):
-    await asyncio.sleep(random.randint(60, 120))
-    async with aiosqlite.connect(DB_PATH) as db:
-        async with db.execute("SELECT aisports_bonus_received FROM users WHERE user_id = ?", (user_id,)) as cur:
-            row = await cur.fetchone()
-            if not row or row[0] == 1:
-                return
-        await db.execute("UPDATE users SET balance = balance + ?, aisports_bonus_received = 1 WHERE user_id = ?", (AISPORTS_BONUS, user_id))
-        await db.commit()
-    try:
-        await bot.send_message(user_id,
-            f"🎁 **30 000 soʻm aisports dan bonus puli hisobingizga qoʻshildi!**\n\n💰 Yangi balans: {await get_user_balance(user_id):,} soʻm\n\n📊 Doʻstlaringizni taklif qilib yana pul ishlashingiz mumkin.",
-            parse_mode="Markdown")
-    except Exception as e:
-        logger.error(f"Aisports bonus xabari yuborilmadi ({user_id}): {e}")
+def aisports_bonus_message(balance: int) -> dict:
+    return {"text": f"🎁 **30 000 soʻm aisports dan bonus puli hisobingizga qoʻshildi!**\n\n💰 Yangi balans: {balance:,} soʻm\n\n📊 Doʻstlaringizni taklif qilib yana pul ishlashingiz mumkin.",
+            "parse_mode": "Markdown"}
 
 async def schedule_aisports_bonus(user_id: int, context):
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with db_pool.read() as db:
         async with db.execute("SELECT aisports_bonus_received FROM users WHERE user_id = ?", (user_id,)) as cur:
             row = await cur.fetchone()
-            if not row or row[0] == 0:
-                asyncio.create_task(give_aisports_bonus(user_id, context.bot))
+    if not row or row[0] == 0:
+        job_runner.enqueue_nowait("aisports_bonus", {"user_id": user_id},
+                                  delay=random.randint(*AISPORTS_DELAY), dedupe_key=f"aisports_bonus:{user_id}")
+
+async def aisports_bonus_job(jobs):
+    """Bonuslarni bitta tranzaksiyada beradi va xabarlarni outboxga yozadi."""
+    rows = []
+    async with db_pool.write() as db:
+        for _, payload in jobs:
+            user_id = payload["user_id"]
+            async with db.execute(
+                "UPDATE users SET balance = balance + ?, aisports_bonus_received = 1 "
+                "WHERE user_id = ? AND aisports_bonus_received = 0 RETURNING balance",
+                (AISPORTS_BONUS, user_id)) as cur:
+                row = await cur.fetchone()
+            if row:
+                rows.append(outbox_row(user_id, aisports_bonus_message(row[0])))
+        await db.executemany(OUTBOX_INSERT_SQL, rows)
+    if rows:
+        outbox.notify()
+        logger.info(f"Aisports bonus berildi: {len(rows)} ta")
 
 # ========== ADMIN ==========
-async def is_admin(user_id: int) -> bool:
-    async with aiosqlite.connect(DB_PATH) as db:
-        async with db.execute("SELECT 1 FROM admins WHERE user_id = ?", (user_id,)) as cur:
-            return await cur.fetchone() is not None
+# Adminlar to'plami xotirada saqlanadi: init_db da yuklanadi va faqat
+# add_admin/remove_admin orqali (DB yozuvi muvaffaqiyatli bo'lgandan keyin) o'zgaradi.
+admin_ids: set = set()
+
+async def load_admin_ids():
+    async with db_pool.read() as db:
+        async with db.execute("SELECT user_id FROM admins") as cur:
+            rows = await cur.fetchall()
+    admin_ids.clear()
+    admin_ids.update(r[0] for r in rows)
+
+def is_admin(user_id: int) -> bool:
+    return user_id in admin_ids
+
+def admin_only(deny_text: Optional[str] = "❌ Siz admin emassiz.", deny_result=None):
+    """Handlerni faqat adminlar uchun ochadi; boshqalarga deny_text yuboriladi
+    (None bo'lsa jim) va deny_result qaytariladi."""
+    def decorator(handler):
+        @functools.wraps(handler)
+        async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
+            if not is_admin(update.effective_user.id):
+                if deny_text:
+                    await update.effective_message.reply_text(deny_text)
+                return deny_result
+            return await handler(update, context)
+        return wrapper
+    return decorator
 
 async def add_admin(user_id: int, added_by: int) -> bool:
     try:
-        async with aiosqlite.connect(DB_PATH) as db:
+        async with db_pool.write() as db:
             await db.execute("INSERT INTO admins (user_id, added_by) VALUES (?, ?)", (user_id, added_by))
-            await db.commit()
-            return True
     except:
         return False
+    admin_ids.add(user_id)
+    coordinator.publish("admins", {})
+    return True
 
 async def remove_admin(user_id: int) -> bool:
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with db_pool.write() as db:
         await db.execute("DELETE FROM admins WHERE user_id = ?", (user_id,))
-        await db.commit()
-        return True
+    admin_ids.discard(user_id)
+    coordinator.publish("admins", {})
+    return True
 
 async def get_all_admins():
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with db_pool.read() as db:
         async with db.execute("SELECT user_id, added_by, added_at FROM admins ORDER BY added_at") as cur:
             return await cur.fetchall()
 
 # ========== ANALYSIS ==========
 async def update_analysis_text(match_id: int, analysis: str, added_by: int):
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with db_pool.write() as db:
         await db.execute("""
             INSERT INTO match_analyses (match_id, analysis, added_by)
             VALUES (?, ?, ?)
@@ -340,10 +1211,10 @@ async def update_analysis_text(match_id: int, analysis: str, added_by: int):
                 added_by = excluded.added_by,
                 added_at = CURRENT_TIMESTAMP
         """, (match_id, analysis, added_by))
-        await db.commit()
+    invalidate_match_view(match_id)
 
 async def update_analysis_url(match_id: int, url: str, added_by: int):
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with db_pool.write() as db:
         async with db.execute("SELECT analysis FROM match_analyses WHERE match_id = ?", (match_id,)) as cur:
             row = await cur.fetchone()
         if row:
@@ -357,10 +1228,10 @@ async def update_analysis_url(match_id: int, url: str, added_by: int):
                 INSERT INTO match_analyses (match_id, analysis, analysis_url, added_by)
                 VALUES (?, ?, ?, ?)
             """, (match_id, "📝 Tahlil kutilmoqda", url, added_by))
-        await db.commit()
+    invalidate_match_view(match_id)
 
 async def add_full_analysis(match_id: int, analysis: str, url: str, added_by: int):
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with db_pool.write() as db:
         await db.execute("""
             INSERT INTO match_analyses (match_id, analysis, analysis_url, added_by)
             VALUES (?, ?, ?, ?)
@@ -370,33 +1241,38 @@ async def add_full_analysis(match_id: int, analysis: str, url: str, added_by: in
                 added_by = excluded.added_by,
                 added_at = CURRENT_TIMESTAMP
         """, (match_id, analysis, url, added_by))
-        await db.commit()
+    invalidate_match_view(match_id)
 
 async def update_match_media(match_id: int, file_id: str, media_type: str, caption: str, added_by: int):
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with db_pool.write() as db:
         await db.execute("""
             UPDATE match_analyses
             SET media_file_id = ?, media_type = ?, media_caption = ?, added_by = ?, added_at = CURRENT_TIMESTAMP
             WHERE match_id = ?
         """, (file_id, media_type, caption, added_by, match_id))
-        await db.commit()
+    invalidate_match_view(match_id)
 
 async def get_analysis(match_id: int):
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with db_pool.read() as db:
         async with db.execute("SELECT analysis, analysis_url, media_file_id, media_type, media_caption, added_at FROM match_analyses WHERE match_id = ?", (match_id,)) as cur:
             return await cur.fetchone()
 
+async def analysis_exists(match_id: int) -> bool:
+    async with db_pool.read() as db:
+        async with db.execute("SELECT 1 FROM match_analyses WHERE match_id = ?", (match_id,)) as cur:
+            return await cur.fetchone() is not None
+
 # ========== MATCH BUTTONS ==========
 async def add_match_button(match_id: int, row: int, col: int, text: str, btype: str, data: str):
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with db_pool.write() as db:
         await db.execute("""
             INSERT INTO match_buttons (match_id, row_order, col_order, button_text, button_type, button_data)
             VALUES (?, ?, ?, ?, ?, ?)
         """, (match_id, row, col, text, btype, data))
-        await db.commit()
+    invalidate_match_view(match_id)
 
 async def get_match_buttons(match_id: int):
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with db_pool.read() as db:
         async with db.execute(
             "SELECT id, row_order, col_order, button_text, button_type, button_data FROM match_buttons WHERE match_id = ? ORDER BY row_order, col_order",
             (match_id,)
@@ -404,66 +1280,202 @@ async def get_match_buttons(match_id: int):
             return await cur.fetchall()
 
 async def delete_match_button(button_id: int, match_id: int):
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with db_pool.write() as db:
         await db.execute("DELETE FROM match_buttons WHERE id = ? AND match_id = ?", (button_id, match_id))
-        await db.commit()
+    invalidate_match_view(match_id)
 
 # ========== SUBSCRIPTIONS ==========
 async def subscribe_user(user_id: int, match_id: int, match_time: str, home: str, away: str, league: str):
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with db_pool.write() as db:
         await db.execute("""INSERT OR REPLACE INTO subscriptions 
             (user_id, match_id, match_time, home_team, away_team, league_code, notified_1h, notified_15m, notified_lineups)
             VALUES (?, ?, ?, ?, ?, ?, 0, 0, 0)""", (user_id, match_id, match_time, home, away, league))
-        await db.commit()
+    # Eslatmalarni faqat leader yuboradi; boshqa worker unga hodisa orqali xabar beradi
+    if coordinator.is_leader:
+        reminder_wheel.schedule_match(match_id, datetime.strptime(match_time, MATCH_TIME_FORMAT))
+    coordinator.publish("subscription", {"match_id": match_id, "match_time": match_time})
 
 async def unsubscribe_user(user_id: int, match_id: int):
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with db_pool.write() as db:
         await db.execute("DELETE FROM subscriptions WHERE user_id = ? AND match_id = ?", (user_id, match_id))
-        await db.commit()
+        async with db.execute("SELECT 1 FROM subscriptions WHERE match_id = ? LIMIT 1", (match_id,)) as cur:
+            has_subscribers = await cur.fetchone() is not None
+    if not has_subscribers:
+        reminder_wheel.cancel_match(match_id)
+
+async def is_subscribed(user_id: int, match_id: int) -> bool:
+    async with db_pool.read() as db:
+        async with db.execute("SELECT 1 FROM subscriptions WHERE user_id = ? AND match_id = ?", (user_id, match_id)) as cur:
+            return await cur.fetchone() is not None
 
-async def get_all_subscriptions():
-    async with aiosqlite.connect(DB_PATH) as db:
-        async with db.execute("""SELECT user_id, match_id, match_time, home_team, away_team, league_code,
-            notified_1h, notified_15m, notified_lineups FROM subscriptions""") as cur:
-            return await cur.fetchall()
+MATCH_TIME_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
 
-async def update_notification_flags(user_id: int, match_id: int, **kwargs):
-    async with aiosqlite.connect(DB_PATH) as db:
-        updates = []
-        params = []
-        if kwargs.get('one_hour'):
-            updates.append("notified_1h = 1")
-        if kwargs.get('fifteen_min'):
-            updates.append("notified_15m = 1")
-        if kwargs.get('lineups'):
-            updates.append("notified_lineups = 1")
-        if not updates: return
-        query = f"UPDATE subscriptions SET {', '.join(updates)} WHERE user_id = ? AND match_id = ?"
-        params.extend([user_id, match_id])
-        await db.execute(query, params)
-        await db.commit()
+# Botni bloklagan (users.is_active = 0) obunachilarni chiqarib tashlash; subscriptions `s` deb nomlanadi
+ACTIVE_SUBSCRIBER_SQL = "NOT EXISTS (SELECT 1 FROM users u WHERE u.user_id = s.user_id AND u.is_active = 0)"
+NOTIFICATION_FLAG_COLUMNS = {
+    "one_hour": "notified_1h",
+    "fifteen_min": "notified_15m",
+    "lineups": "notified_lineups",
+}
+# Bayroqni faqat hali 0 bo'lgan qatorlarda o'rnatadi va o'sha user_id larni qaytaradi
+NOTIFICATION_FLAG_SQL = {
+    flag: f"UPDATE subscriptions SET {column} = 1 WHERE match_id = ? AND {column} = 0 AND user_id IN ({{}}) RETURNING user_id"
+    for flag, column in NOTIFICATION_FLAG_COLUMNS.items()
+}
+NOTIFICATION_FLAG_CHUNK = 500
+
+async def get_pending_reminder(match_id: int, flag: str):
+    """Match uchun `flag` hali o'rnatilmagan obunachilar (idx_subscriptions_match orqali)."""
+    column = NOTIFICATION_FLAG_COLUMNS[flag]
+    async with db_pool.read() as db:
+        async with db.execute(f"""SELECT match_time, home_team, away_team, league_code, user_id
+                FROM subscriptions s WHERE match_id = ? AND {column} = 0 AND {ACTIVE_SUBSCRIBER_SQL}""",
+                (match_id,)) as cur:
+            rows = await cur.fetchall()
+    if not rows:
+        return None
+    tstr, home, away, league, _ = rows[0]
+    return {"time": datetime.strptime(tstr, MATCH_TIME_FORMAT), "home": home, "away": away,
+            "league": league, "users": [r[4] for r in rows]}
+
+async def get_upcoming_match_times(since: datetime):
+    """Obunasi bor va `since` dan keyin boshlanadigan matchlar (idx_subscriptions_time orqali)."""
+    async with db_pool.read() as db:
+        async with db.execute(f"""SELECT match_id, MIN(match_time) FROM subscriptions s
+                WHERE match_time >= ? AND {ACTIVE_SUBSCRIBER_SQL} GROUP BY match_id""",
+                (since.strftime(MATCH_TIME_FORMAT),)) as cur:
+            rows = await cur.fetchall()
+    return [(mid, datetime.strptime(tstr, MATCH_TIME_FORMAT)) for mid, tstr in rows]
 
 async def get_subscribers_for_match(match_id: int):
-    async with aiosqlite.connect(DB_PATH) as db:
-        async with db.execute("SELECT user_id FROM subscriptions WHERE match_id = ?", (match_id,)) as cur:
+    async with db_pool.read() as db:
+        async with db.execute(f"SELECT user_id FROM subscriptions s WHERE match_id = ? AND {ACTIVE_SUBSCRIBER_SQL}",
+                              (match_id,)) as cur:
             rows = await cur.fetchall()
             return [r[0] for r in rows]
 
 # ========== MATCH DATA FUNCTIONS ==========
-async def fetch_matches_by_league(league_code: str):
+async def _fetch_league(league_code: str, priority: int = PRIORITY_INTERACTIVE):
     today = datetime.now().strftime("%Y-%m-%d")
     end_date = (datetime.now() + timedelta(days=DAYS_AHEAD)).strftime("%Y-%m-%d")
     url = f"{FOOTBALL_DATA_URL}/matches"
     params = {"competitions": league_code, "dateFrom": today, "dateTo": end_date, "status": "SCHEDULED,LIVE,IN_PLAY,PAUSED,FINISHED"}
-    res = await rate_limited_api_call(url, HEADERS, params)
+    res = await rate_limited_api_call(url, HEADERS, params, priority=priority)
     if "success" in res:
         return {"success": res["success"].get("matches", [])}
     return res
 
-async def fetch_match_lineups(match_id: int):
-    match = await get_cached_match(match_id)
-    if not match:
-        return None
+# ========== BULK MATCH REFRESH ==========
+BULK_REFRESH_INTERVAL = 5 * 60
+BULK_REFRESH_CHUNK = 50
+
+async def get_tracked_match_ids():
+    """Obunachisi yoki yaqinda tahlili bor matchlar."""
+    since = (datetime.utcnow() - timedelta(hours=3)).strftime(MATCH_TIME_FORMAT)
+    async with db_pool.read() as db:
+        async with db.execute("""SELECT DISTINCT match_id FROM subscriptions WHERE match_time >= ?
+                UNION SELECT match_id FROM match_analyses WHERE added_at >= datetime('now', ?)""",
+                (since, f"-{DAYS_AHEAD * 2} days")) as cur:
+            return [r[0] for r in await cur.fetchall()]
+
+async def refresh_matches_bulk(match_ids, priority: int = PRIORITY_BACKGROUND) -> int:
+    """/matches?ids=... orqali ko'p matchning holati va hisobini bitta so'rovda yangilaydi.
+
+    Javob qisqa shaklda (tarkibsiz), shuning uchun mavjud to'liq yozuvlar ustiga qo'shiladi.
+    """
+    match_ids = sorted(set(match_ids))
+    refreshed = 0
+    for i in range(0, len(match_ids), BULK_REFRESH_CHUNK):
+        chunk = match_ids[i:i + BULK_REFRESH_CHUNK]
+        res = await rate_limited_api_call(f"{FOOTBALL_DATA_URL}/matches", HEADERS,
+                                          {"ids": ",".join(map(str, chunk))}, priority=priority)
+        if "success" not in res:
+            logger.warning(f"Bulk match yangilash xatosi: {res['error']}")
+            continue
+        for m in res["success"].get("matches", []):
+            await match_cache.merge_summary(m["id"], m)
+            refreshed += 1
+    return refreshed
+
+async def match_refresher():
+    while True:
+        try:
+            ids = [mid for mid in await get_tracked_match_ids() if match_cache.needs_refresh(mid)]
+            if ids:
+                n = await refresh_matches_bulk(ids)
+                logger.info(f"Bulk yangilash: {n}/{len(ids)} ta match")
+        except Exception as e:
+            logger.exception(f"Match refresher xatosi: {e}")
+        await asyncio.sleep(BULK_REFRESH_INTERVAL)
+
+# ========== LEAGUE FIXTURES SNAPSHOT ==========
+LEAGUE_REFRESH_INTERVAL = 15 * 60
+league_fixtures = {}  # league_code -> (matches, fetched_at)
+
+def _store_league_snapshot(league_code: str, matches: list, fetched_at: float):
+    league_fixtures[league_code] = (matches, fetched_at)
+    # Keyingi match_ bosishlari API so'rovisiz ochilishi uchun
+    for m in matches:
+        match_cache.prime(m["id"], m, fetched_at)
+
+async def load_league_fixtures():
+    """Startda SQLite'dagi oxirgi snapshotlarni xotiraga yuklaydi."""
+    async with db_pool.read() as db:
+        async with db.execute("SELECT league_code, payload, fetched_at FROM league_fixtures") as cur:
+            rows = await cur.fetchall()
+    for code, payload, fetched_at in rows:
+        _store_league_snapshot(code, json.loads(payload), fetched_at)
+    logger.info(f"Liga snapshotlari yuklandi: {len(rows)} ta")
+
+async def refresh_league(league_code: str, priority: int = PRIORITY_BACKGROUND):
+    res = await api_flight.do(("league", league_code), lambda: _fetch_league(league_code, priority))
+    if "success" not in res:
+        return res
+    fetched_at = time.time()
+    async with db_pool.write() as db:
+        await db.execute("INSERT OR REPLACE INTO league_fixtures (league_code, payload, fetched_at) VALUES (?, ?, ?)",
+                         (league_code, json.dumps(res["success"], ensure_ascii=False), fetched_at))
+    _store_league_snapshot(league_code, res["success"], fetched_at)
+    coordinator.publish("league", {"code": league_code})
+    return res
+
+async def _on_league_event(payload: dict):
+    """Boshqa worker yangilagan snapshotni DB dan o'qiydi."""
+    async with db_pool.read() as db:
+        async with db.execute("SELECT payload, fetched_at FROM league_fixtures WHERE league_code = ?",
+                              (payload["code"],)) as cur:
+            row = await cur.fetchone()
+    if row:
+        _store_league_snapshot(payload["code"], json.loads(row[0]), row[1])
+
+async def league_prefetcher():
+    """TOP_LEAGUES o'yinlarini DAYS_AHEAD oynasi bo'yicha davriy ravishda yangilaydi."""
+    while True:
+        for code in TOP_LEAGUES:
+            try:
+                res = await refresh_league(code)
+                if "error" in res:
+                    logger.warning(f"Liga {code} yangilanmadi: {res['error']}")
+            except Exception as e:
+                logger.exception(f"Liga prefetch xatosi ({code}): {e}")
+        await asyncio.sleep(LEAGUE_REFRESH_INTERVAL)
+
+async def fetch_matches_by_league(league_code: str):
+    snapshot = league_fixtures.get(league_code)
+    if snapshot is None:
+        # Snapshot hali yo'q (birinchi ishga tushish) – bir marta jonli so'rov
+        res = await refresh_league(league_code, PRIORITY_INTERACTIVE)
+        if "error" in res:
+            return res
+        snapshot = league_fixtures[league_code]
+    today = datetime.utcnow().strftime("%Y-%m-%d")
+    return {"success": [m for m in snapshot[0] if m.get("utcDate", "")[:10] >= today]}
+
+async def fetch_match_lineups(match_id: int, allow_stale: bool = True):
+    match = await get_cached_match(match_id, detailed=True, allow_stale=allow_stale)
+    return match_lineups(match) if match else None
+
+def match_lineups(match: dict) -> dict:
     home = match.get("homeTeam", {})
     away = match.get("awayTeam", {})
     return {
@@ -596,6 +1608,11 @@ def build_matches_keyboard(matches):
     kb.append(money_row())
     return InlineKeyboardMarkup(kb)
 
+def build_links_keyboard(links, limit: int = 6, per_row: int = 2):
+    """Tashqi saytlar havolalari uchun URL tugmalar (URL lar percent-encode qilinadi)."""
+    buttons = [InlineKeyboardButton(name, url=quote(url, safe=":/?#=&%")) for name, url in links[:limit]]
+    return InlineKeyboardMarkup([buttons[i:i + per_row] for i in range(0, len(buttons), per_row)])
+
 def build_match_keyboard(mid, is_subscribed, lineups_available, custom_buttons):
     """
     custom_buttons: list of tuples (id, row, col, text, type, data)
@@ -638,6 +1655,89 @@ def build_match_keyboard(mid, is_subscribed, lineups_available, custom_buttons):
     kb.append(money_row())
     return InlineKeyboardMarkup(kb)
 
+# ========== MATCH VIEW KESHI ==========
+MATCH_VIEW_CACHE_SIZE = 1000
+
+class MatchView(NamedTuple):
+    """match_ callback uchun tayyor ko'rinish: matn/media va ikkala holat uchun klaviatura."""
+    text: str
+    admin_text: Optional[str]
+    media_type: Optional[str]
+    media_file_id: Optional[str]
+    keyboards: dict  # is_subscribed -> InlineKeyboardMarkup
+    expires_at: float  # match nusxasi muddati (MatchCache.ttl_for); keyin qayta render qilinadi
+
+match_views = OrderedDict()
+_match_view_versions = {}  # match_id -> invalidatsiyalar soni
+
+def invalidate_match_view(match_id: int, publish: bool = True):
+    """publish=True bo'lsa boshqa workerlar ham o'z ko'rinishini tashlaydi."""
+    match_views.pop(match_id, None)
+    _match_view_versions[match_id] = _match_view_versions.get(match_id, 0) + 1
+    if publish:
+        coordinator.publish("match_view", {"id": match_id})
+
+async def _on_match_view_event(payload: dict):
+    invalidate_match_view(payload["id"], publish=False)
+
+async def _render_match_view(mid: int, match: Optional[dict], expires_at: float) -> MatchView:
+    analysis_row = await get_analysis(mid)
+    home = away = "Noma'lum"
+    match_status = "SCHEDULED"
+    match_time_str = ""
+    if match:
+        home = match.get("homeTeam", {}).get("name", "Noma'lum")
+        away = match.get("awayTeam", {}).get("name", "Noma'lum")
+        match_status = match.get("status", "SCHEDULED")
+        utc_date = match.get("utcDate", "")
+        if utc_date:
+            dt = datetime.strptime(utc_date, "%Y-%m-%dT%H:%M:%SZ") + timedelta(hours=5)
+            match_time_str = dt.strftime("%d.%m.%Y %H:%M")
+        else:
+            match_time_str = "Vaqt noma'lum"
+    else:
+        match_time_str = "Maʼlumot yoʻq"
+
+    custom_buttons = await get_match_buttons(mid)
+    lineups = match_lineups(match) if match else None
+    lineups_avail = lineups and (lineups['home_lineup'] or lineups['away_lineup'])
+    keyboards = {subscribed: build_match_keyboard(mid, subscribed, lineups_avail, custom_buttons)
+                 for subscribed in (True, False)}
+
+    admin_text = media_type = media_file_id = None
+    if analysis_row:
+        analysis_text, analysis_url, file_id, mtype, media_caption, added_at = analysis_row
+        added_date_str = datetime.strptime(added_at, "%Y-%m-%d %H:%M:%S").strftime("%d.%m.%Y %H:%M")
+        safe_text = escape_markdown(analysis_text, version=2)
+        msg = format_analysis_message(mid, home, away, match_time_str, match_status, safe_text, added_date_str)
+        if file_id and mtype in MEDIA_SENDERS:
+            media_type, media_file_id = mtype, file_id
+            msg = media_caption or msg
+    else:
+        msg = f"⚽ **Oʻyin tahlili**\n\n🆔 Match ID: `{mid}`\n📊 Hozircha tahlil mavjud emas."
+        admin_text = msg + f"\n\n💡 Admin: `/addanalysis {mid} <tahlil>`"
+    return MatchView(msg, admin_text, media_type, media_file_id, keyboards, expires_at)
+
+async def get_match_view(mid: int) -> MatchView:
+    view = match_views.get(mid)
+    if view is not None:
+        if time.time() < view.expires_at:
+            match_views.move_to_end(mid)
+            return view
+        # Holat, vaqt va tarkiblar eskirgan bo'lishi mumkin: match keshi TTL/fon yangilanishi orqali qayta
+        del match_views[mid]
+    # Match avval olinadi: uning o'z yozuvi (set -> invalidatsiya) versiyaga hisoblanmaydi
+    match = await get_cached_match(mid, detailed=True)
+    version = _match_view_versions.get(mid, 0)
+    view = await _render_match_view(mid, match, match_cache.expires_at(mid))
+    # Render paytida shu match invalidatsiya bo'lgan bo'lsa, eski ko'rinishni saqlamaslik;
+    # match ma'lumoti olinmagan bo'lsa ham keshga yozilmaydi
+    if match is not None and version == _match_view_versions.get(mid, 0):
+        match_views[mid] = view
+        while len(match_views) > MATCH_VIEW_CACHE_SIZE:
+            match_views.popitem(last=False)
+    return view
+
 # ========== ADMIN PANEL TUGMALARI ==========
 def admin_main_menu():
     """Asosiy admin menyusi"""
@@ -694,7 +1794,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if ref == u.id: ref = None
     await get_or_create_user(u.id, ref, context.bot, u.first_name)
     await schedule_aisports_bonus(u.id, context)
-    bot_username = (await context.bot.get_me()).username
+    bot_username = context.bot.username
     ref_link = await get_referral_link(u.id, bot_username)
     text = (f"👋 Assalomu alaykum, {u.first_name}!\n\n⚽ Ushbu bot orqali top 5 chempionat oʻyinlarini kuzatishingiz, "
             f"tahlillarni olishingiz va oʻyinlar haqida eslatmalarni sozlashingiz mumkin.\n\n"
@@ -705,12 +1805,9 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
             f"Quyida ligalardan birini tanlang:")
     await update.message.reply_text(text, parse_mode="Markdown", reply_markup=get_leagues_keyboard())
 
+@admin_only()
 async def admin_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Admin panelni ochish"""
-    uid = update.effective_user.id
-    if not await is_admin(uid):
-        await update.message.reply_text("❌ Siz admin emassiz.")
-        return
     await update.message.reply_text("👑 **Admin panel**", parse_mode="Markdown", reply_markup=admin_main_menu())
 
 async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -721,7 +1818,7 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     # ---------- PUL ISHLASH INFO + SHARE ----------
     if data == "money_info":
-        bot_username = (await context.bot.get_me()).username
+        bot_username = context.bot.username
         ref_link = await get_referral_link(uid, bot_username)
         stats = await get_referral_stats(uid)
         bal = await get_user_balance(uid)
@@ -779,7 +1876,7 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if data == "back_to_start":
         u = update.effective_user
         await get_or_create_user(u.id, None)
-        bot_username = (await context.bot.get_me()).username
+        bot_username = context.bot.username
         ref_link = await get_referral_link(u.id, bot_username)
         text = (f"👋 Assalomu alaykum, {u.first_name}!\n\n⚽ Ushbu bot orqali top 5 chempionat oʻyinlarini kuzatishingiz, "
                 f"tahlillarni olishingiz va oʻyinlar haqida eslatmalarni sozlashingiz mumkin.\n\n"
@@ -801,7 +1898,8 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if not info:
             await q.edit_message_text("❌ Notoʻgʻri tanlov.")
             return
-        await q.edit_message_text(f"⏳ {info['name']} – oʻyinlar yuklanmoqda...")
+        if code not in league_fixtures:
+            await q.edit_message_text(f"⏳ {info['name']} – oʻyinlar yuklanmoqda...")
         res = await fetch_matches_by_league(code)
         if "error" in res:
             await q.edit_message_text(res["error"], reply_markup=get_leagues_keyboard())
@@ -816,58 +1914,14 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     if data.startswith("match_"):
         mid = int(data.split("_")[1])
-        analysis_row = await get_analysis(mid)
-        match = await get_cached_match(mid)
-        league = "PL"
-        home = away = "Noma'lum"
-        match_status = "SCHEDULED"
-        match_time_str = ""
-        if match:
-            league = match.get("competition", {}).get("code", "PL")
-            home = match.get("homeTeam", {}).get("name", "Noma'lum")
-            away = match.get("awayTeam", {}).get("name", "Noma'lum")
-            match_status = match.get("status", "SCHEDULED")
-            utc_date = match.get("utcDate", "")
-            if utc_date:
-                dt = datetime.strptime(utc_date, "%Y-%m-%dT%H:%M:%SZ") + timedelta(hours=5)
-                match_time_str = dt.strftime("%d.%m.%Y %H:%M")
-            else:
-                match_time_str = "Vaqt noma'lum"
-        else:
-            match_time_str = "Maʼlumot yoʻq"
-
-        custom_buttons = await get_match_buttons(mid)
-        async with aiosqlite.connect(DB_PATH) as db:
-            async with db.execute("SELECT 1 FROM subscriptions WHERE user_id = ? AND match_id = ?", (uid, mid)) as cur:
-                subscribed = await cur.fetchone() is not None
-        lineups = await fetch_match_lineups(mid)
-        lineups_avail = lineups and (lineups['home_lineup'] or lineups['away_lineup'])
-        keyboard = build_match_keyboard(mid, subscribed, lineups_avail, custom_buttons)
-
-        if analysis_row:
-            analysis_text, analysis_url, media_file_id, media_type, media_caption, added_at = analysis_row
-            added_date_str = datetime.strptime(added_at, "%Y-%m-%d %H:%M:%S").strftime("%d.%m.%Y %H:%M")
-            safe_text = escape_markdown(analysis_text, version=2)
-            msg = format_analysis_message(mid, home, away, match_time_str, match_status, safe_text, added_date_str)
-        else:
-            msg = f"⚽ **Oʻyin tahlili**\n\n🆔 Match ID: `{mid}`\n📊 Hozircha tahlil mavjud emas."
-            if await is_admin(uid):
-                msg += f"\n\n💡 Admin: `/addanalysis {mid} <tahlil>`"
-
-        if analysis_row and analysis_row[2]:
-            file_id = analysis_row[2]
-            mtype = analysis_row[3]
-            caption = analysis_row[4] or msg
-            if mtype == 'photo':
-                await context.bot.send_photo(chat_id=uid, photo=file_id, caption=caption, parse_mode="Markdown", reply_markup=keyboard)
-            elif mtype == 'document':
-                await context.bot.send_document(chat_id=uid, document=file_id, caption=caption, parse_mode="Markdown", reply_markup=keyboard)
-            elif mtype == 'video':
-                await context.bot.send_video(chat_id=uid, video=file_id, caption=caption, parse_mode="Markdown", reply_markup=keyboard)
-            else:
-                await context.bot.send_message(chat_id=uid, text=msg, parse_mode="Markdown", reply_markup=keyboard)
-        else:
-            await context.bot.send_message(chat_id=uid, text=msg, parse_mode="Markdown", reply_markup=keyboard)
+        view = await get_match_view(mid)
+        subscribed = await is_subscribed(uid, mid)
+        text = view.admin_text if view.admin_text and is_admin(uid) else view.text
+        message = {"text": text, "parse_mode": "Markdown", "reply_markup": view.keyboards[subscribed]}
+        if view.media_type:
+            message["media_type"] = view.media_type
+            message["media_file_id"] = view.media_file_id
+        await send_rendered(context.bot, uid, message)
         return
 
     if data.startswith("lineups_"):
@@ -888,9 +1942,7 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         links = generate_match_links(mid, home, away, league)
         msg += "\n\n" + format_links_message(links)
         custom_buttons = await get_match_buttons(mid)
-        async with aiosqlite.connect(DB_PATH) as db:
-            async with db.execute("SELECT 1 FROM subscriptions WHERE user_id = ? AND match_id = ?", (uid, mid)) as cur:
-                subscribed = await cur.fetchone() is not None
+        subscribed = await is_subscribed(uid, mid)
         lineups_avail = lineups and (lineups['home_lineup'] or lineups['away_lineup'])
         keyboard = build_match_keyboard(mid, subscribed, lineups_avail, custom_buttons)
         await q.edit_message_text(msg, parse_mode="Markdown", reply_markup=keyboard)
@@ -907,27 +1959,21 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         t = match["utcDate"]
         league = match.get("competition", {}).get("code", "PL")
         await subscribe_user(uid, mid, t, home, away, league)
-        custom_buttons = await get_match_buttons(mid)
-        lineups = await fetch_match_lineups(mid)
-        lineups_avail = lineups and (lineups['home_lineup'] or lineups['away_lineup'])
-        new_kb = build_match_keyboard(mid, is_subscribed=True, lineups_available=lineups_avail, custom_buttons=custom_buttons)
-        await q.edit_message_reply_markup(reply_markup=new_kb)
+        view = await get_match_view(mid)
+        await q.edit_message_reply_markup(reply_markup=view.keyboards[True])
         await q.answer("✅ Kuzatish boshlandi!", show_alert=False)
         return
 
     if data.startswith("unsubscribe_"):
         mid = int(data.split("_")[1])
         await unsubscribe_user(uid, mid)
-        custom_buttons = await get_match_buttons(mid)
-        lineups = await fetch_match_lineups(mid)
-        lineups_avail = lineups and (lineups['home_lineup'] or lineups['away_lineup'])
-        new_kb = build_match_keyboard(mid, is_subscribed=False, lineups_available=lineups_avail, custom_buttons=custom_buttons)
-        await q.edit_message_reply_markup(reply_markup=new_kb)
+        view = await get_match_view(mid)
+        await q.edit_message_reply_markup(reply_markup=view.keyboards[False])
         await q.answer("❌ Kuzatish bekor qilindi", show_alert=False)
         return
 
     # ---------- ADMIN PANEL NAVIGATION ----------
-    if not await is_admin(uid):
+    if not is_admin(uid):
         await q.answer("❌ Siz admin emassiz.", show_alert=True)
         return
 
@@ -972,83 +2018,738 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # ---------- AGAR BOSHQACHA CALLBACK BO'LSA (CUSTOM BUTTONLAR) ----------
     await q.answer("⏳ Bu funksiya hozircha mavjud emas", show_alert=False)
 
-# ========== NOTIFICATION SCHEDULER ==========
-async def notification_scheduler(app: Application):
+# ========== BROADCAST ==========
+TELEGRAM_GLOBAL_RATE = 28          # msg/s (Telegram umumiy limiti ~30)
+TELEGRAM_PER_CHAT_INTERVAL = 1.0   # bitta chatga xabarlar orasidagi minimal oraliq
+BROADCAST_WORKERS = 20
+BROADCAST_MAX_RETRIES = 3
+BROADCAST_PROGRESS_INTERVAL = 3
+# Yetkazish natijalari: "ok" yoki quyidagilardan biri (boshqa xatolarda – xato matni)
+DELIVERY_BLOCKED = "blocked"                # Forbidden: bot bloklangan, chatdan chiqarilgan, akkaunt o'chirilgan
+DELIVERY_CHAT_NOT_FOUND = "chat_not_found"  # BadRequest: Chat not found
+DELIVERY_RATE_LIMITED = "rate_limited"      # RetryAfter: qayta urinishlar tugadi
+DELIVERY_NETWORK = "network"                # NetworkError/TimedOut: qayta urinishlar tugadi
+DEAD_CHAT_STATUSES = {DELIVERY_BLOCKED, DELIVERY_CHAT_NOT_FOUND}
+RETRYABLE_STATUSES = {DELIVERY_RATE_LIMITED, DELIVERY_NETWORK}
+
+MEDIA_SENDERS = {
+    "photo": ("send_photo", "photo"),
+    "document": ("send_document", "document"),
+    "video": ("send_video", "video"),
+}
+
+class TokenBucket:
+    """Sekundiga `rate` token, `capacity` gacha portlashga ruxsat beruvchi limiter.
+
+    shared berilsa token coordinator dagi shu nomli bucket'dan ham olinadi – limit barcha
+    workerlar uchun umumiy bo'ladi (ApiRateLimiter kabi).
+    """
+
+    def __init__(self, rate: float, capacity: float = None, shared: str = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.shared = shared
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._refill()
+                if self._tokens < 1:
+                    await asyncio.sleep((1 - self._tokens) / self.rate)
+                    continue
+                if self.shared:
+                    delay = await coordinator.take_token(self.shared, self.rate, self.capacity)
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                        continue
+                self._tokens -= 1
+                return
+
+    async def pause(self, seconds: float):
+        """Flood-control (RetryAfter) kelganda barcha jo'natuvchilarni to'xtatib turadi."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0
+        self._updated = self._paused_until
+        if self.shared:
+            await coordinator.clamp_tokens(self.shared, self.rate, self.capacity, 1 - seconds * self.rate)
+
+def retry_after_seconds(error: RetryAfter) -> float:
+    ra = error.retry_after
+    return ra.total_seconds() if isinstance(ra, timedelta) else float(ra)
+
+async def send_rendered(bot, chat_id: int, message: dict):
+    """Tayyor xabarni (matn yoki media) bitta chatga yuboradi.
+
+    message: text, parse_mode, reply_markup, disable_web_page_preview, media_type, media_file_id
+    """
+    kwargs = {k: v for k, v in message.items() if k not in ("media_type", "media_file_id")}
+    sender = MEDIA_SENDERS.get(message.get("media_type"))
+    if sender and message.get("media_file_id"):
+        method, field = sender
+        kwargs.pop("disable_web_page_preview", None)
+        kwargs["caption"] = kwargs.pop("text", None)
+        kwargs[field] = message["media_file_id"]
+        return await getattr(bot, method)(chat_id=chat_id, **kwargs)
+    return await bot.send_message(chat_id=chat_id, **kwargs)
+
+class BroadcastResult:
+    def __init__(self, total: int):
+        self.total = total
+        self.sent = 0
+        self.failed = 0
+        self.blocked = 0
+        self.cancelled = False
+        self.results = {}  # chat_id -> "ok", DELIVERY_* yoki xato matni
+        self.started = time.monotonic()
+
+    @property
+    def done(self) -> int:
+        return self.sent + self.failed + self.blocked
+
+    def record(self, chat_id: int, status: str):
+        self.results[chat_id] = status
+        if status == "ok":
+            self.sent += 1
+        elif status in DEAD_CHAT_STATUSES:
+            self.blocked += 1
+        else:
+            self.failed += 1
+
+    def throughput(self) -> float:
+        elapsed = time.monotonic() - self.started
+        return self.done / elapsed if elapsed > 0 else 0.0
+
+class Broadcaster:
+    """Cheklangan worker pool + token-bucket orqali ko'p chatga xabar tarqatish.
+
+    Telegram limiti bot tokeniga tegishli, shuning uchun bucket barcha workerlar uchun umumiy.
+    """
+
+    def __init__(self, rate: float = TELEGRAM_GLOBAL_RATE, workers: int = BROADCAST_WORKERS,
+                 per_chat_interval: float = TELEGRAM_PER_CHAT_INTERVAL):
+        self.bucket = TokenBucket(rate, shared="telegram")
+        self.workers = workers
+        self.per_chat_interval = per_chat_interval
+        self._chat_slots = {}
+
+    async def _wait_chat_slot(self, chat_id: int):
+        now = time.monotonic()
+        slot = max(now, self._chat_slots.get(chat_id, 0.0) + self.per_chat_interval)
+        self._chat_slots[chat_id] = slot
+        if len(self._chat_slots) > 50000:
+            self._chat_slots = {c: t for c, t in self._chat_slots.items() if t > now - self.per_chat_interval}
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    async def deliver(self, bot, chat_id: int, message: dict) -> str:
+        for attempt in range(BROADCAST_MAX_RETRIES + 1):
+            await self._wait_chat_slot(chat_id)
+            await self.bucket.acquire()
+            try:
+                await send_rendered(bot, chat_id, message)
+                return "ok"
+            except RetryAfter as e:
+                delay = retry_after_seconds(e)
+                logger.warning(f"Flood control: {delay} s kutilmoqda (chat {chat_id})")
+                await self.bucket.pause(delay)
+                await asyncio.sleep(delay)
+            except Forbidden:
+                return DELIVERY_BLOCKED
+            except BadRequest as e:
+                if "chat not found" in str(e).lower():
+                    return DELIVERY_CHAT_NOT_FOUND
+                return str(e)
+            except NetworkError as e:
+                if attempt == BROADCAST_MAX_RETRIES:
+                    logger.warning(f"Tarmoq xatosi (chat {chat_id}): {e}")
+                    return DELIVERY_NETWORK
+                await asyncio.sleep(2 ** attempt)
+            except Exception as e:
+                return str(e)
+        return DELIVERY_RATE_LIMITED
+
+    async def run(self, bot, deliveries, on_progress=None, on_sent=None, on_failed=None,
+                  cancel: asyncio.Event = None) -> BroadcastResult:
+        """deliveries: [(chat_id, [message, ...]), ...] – har chatning xabarlari ketma-ket yuboriladi.
+
+        on_progress(result) har BROADCAST_PROGRESS_INTERVAL soniyada va oxirida chaqiriladi,
+        on_sent(chat_id) chatga barcha xabarlar yetkazilganda, on_failed(chat_id, status) esa xatoda.
+        cancel o'rnatilsa yangi chatlar olinmaydi (boshlangan yetkazishlar tugaydi).
+        """
+        deliveries = list(deliveries)
+        result = BroadcastResult(len(deliveries))
+        queue = asyncio.Queue()
+        for item in deliveries:
+            queue.put_nowait(item)
+        last_report = time.monotonic()
+
+        async def report():
+            try:
+                await on_progress(result)
+            except Exception as e:
+                logger.debug(f"Progress xabari yangilanmadi: {e}")
+
+        async def worker():
+            nonlocal last_report
+            while not queue.empty():
+                if cancel is not None and cancel.is_set():
+                    result.cancelled = True
+                    return
+                cid, messages = queue.get_nowait()
+                status = "ok"
+                for message in messages:
+                    status = await self.deliver(bot, cid, message)
+                    if status != "ok":
+                        break
+                result.record(cid, status)
+                if status == "ok":
+                    if on_sent:
+                        await on_sent(cid)
+                else:
+                    if status in DEAD_CHAT_STATUSES:
+                        await deactivate_user(cid, status)
+                    else:
+                        logger.error(f"Broadcast xatosi (user {cid}): {status}")
+                    if on_failed:
+                        await on_failed(cid, status)
+                if on_progress and time.monotonic() - last_report >= BROADCAST_PROGRESS_INTERVAL:
+                    last_report = time.monotonic()
+                    await report()
+
+        await asyncio.gather(*(worker() for _ in range(min(self.workers, len(deliveries)))))
+        if on_progress:
+            await report()
+        return result
+
+    async def broadcast(self, bot, chat_ids, messages, on_progress=None, on_sent=None,
+                        cancel: asyncio.Event = None) -> BroadcastResult:
+        """Bir xil `messages` ro'yxatini har bir chatga yuboradi."""
+        return await self.run(bot, [(cid, messages) for cid in chat_ids], on_progress=on_progress,
+                              on_sent=on_sent, cancel=cancel)
+
+broadcaster = Broadcaster()
+
+# ---------- admin tarqatish vazifalari ----------
+class BroadcastJob:
+    """Fonda ishlayotgan admin tarqatmasi; /cancel <id> bilan to'xtatiladi."""
+
+    def __init__(self, job_id: str, match_id: int, admin_id: int):
+        self.job_id = job_id
+        self.match_id = match_id
+        self.admin_id = admin_id
+        self.cancel = asyncio.Event()
+        self.task = None
+
+broadcast_jobs = {}  # job_id -> BroadcastJob (faqat shu workerda ishlayotganlari)
+
+def format_broadcast_progress(job: BroadcastJob, result: BroadcastResult, finished: bool = False) -> str:
+    if result.cancelled:
+        head = f"⛔ #{job.job_id} bekor qilindi: {result.done}/{result.total}"
+    elif finished:
+        head = f"📢 #{job.job_id}: {result.sent} ta obunachiga bildirishnoma yuborildi."
+    else:
+        head = f"📤 #{job.job_id} yuborilmoqda: {result.done}/{result.total}"
+    text = (f"{head}\n✅ {result.sent} | ❌ {result.failed} | 🚫 {result.blocked} | "
+            f"⚡ {result.throughput():.1f} msg/s")
+    if not finished:
+        text += f"\n\nTo'xtatish: /cancel {job.job_id}"
+    return text
+
+async def broadcast_to_subscribers(update: Update, context: ContextTypes.DEFAULT_TYPE, match_id: int, messages):
+    """Match obunachilariga tarqatishni fonda boshlaydi va darhol job id ni qaytaradi.
+
+    Admin handleri band bo'lib qolmaydi; bitta progress xabari jarayon davomida yangilanadi.
+    """
+    subs = await get_subscribers_for_match(match_id)
+    if not subs:
+        return None
+    job = BroadcastJob(os.urandom(3).hex(), match_id, update.effective_user.id)
+    progress_msg = await update.message.reply_text(
+        f"📤 #{job.job_id}: {len(subs)} ta obunachiga yuborilmoqda...\n\nTo'xtatish: /cancel {job.job_id}")
+
+    async def on_progress(res):
+        await progress_msg.edit_text(format_broadcast_progress(job, res, finished=res.cancelled or res.done == res.total))
+
+    async def run():
+        try:
+            res = await broadcaster.broadcast(context.bot, subs, messages, on_progress=on_progress, cancel=job.cancel)
+            logger.info(f"Tarqatma #{job.job_id} (match {match_id}): {res.sent}/{res.total} yuborildi, "
+                        f"{res.failed} xato, {res.blocked} bloklangan{', bekor qilindi' if res.cancelled else ''}")
+        except Exception as e:
+            logger.exception(f"Tarqatma #{job.job_id} xatosi: {e}")
+        finally:
+            broadcast_jobs.pop(job.job_id, None)
+
+    broadcast_jobs[job.job_id] = job
+    job.task = asyncio.create_task(run())
+    return job.job_id
+
+def cancel_broadcast_job(job_id: str) -> bool:
+    job = broadcast_jobs.get(job_id)
+    if job is None:
+        return False
+    job.cancel.set()
+    return True
+
+async def _on_broadcast_cancel_event(payload: dict):
+    cancel_broadcast_job(payload["job_id"])
+
+async def cancel_broadcast_jobs():
+    """Shutdown: ishlayotgan tarqatmalarni to'xtatib, progress xabari yakunlanishini kutadi."""
+    for job in list(broadcast_jobs.values()):
+        job.cancel.set()
+    tasks = [job.task for job in broadcast_jobs.values() if job.task]
+    if tasks:
+        await asyncio.wait(tasks, timeout=10)
+
+# ========== OUTBOX (DURABLE XABARLAR NAVBATI) ==========
+OUTBOX_BATCH_SIZE = 500
+OUTBOX_POLL_INTERVAL = 5
+OUTBOX_MAX_ATTEMPTS = 5
+
+OUTBOX_INSERT_SQL = """INSERT INTO outbox
+    (chat_id, text, parse_mode, reply_markup, media_type, media_file_id, disable_preview)
+    VALUES (?, ?, ?, ?, ?, ?, ?)"""
+
+def outbox_row(chat_id: int, message: dict, markup_json: dict = None) -> tuple:
+    """send_rendered formatidagi xabarni outbox qatoriga aylantiradi."""
+    markup = message.get("reply_markup")
+    if markup is None:
+        markup_str = None
+    elif markup_json is not None and id(markup) in markup_json:
+        markup_str = markup_json[id(markup)]
+    else:
+        markup_str = json.dumps(markup.to_dict(), ensure_ascii=False)
+        if markup_json is not None:
+            markup_json[id(markup)] = markup_str
+    return (chat_id, message.get("text"), message.get("parse_mode"), markup_str,
+            message.get("media_type"), message.get("media_file_id"),
+            1 if message.get("disable_web_page_preview") else 0)
+
+async def enqueue_messages(items, flags=()):
+    """Xabarlarni outboxga yozadi va bildirishnoma bayroqlarini shu tranzaksiyada o'rnatadi.
+
+    items: [(chat_id, message), ...]; flags: [(flag, user_id, match_id), ...]
+    flags berilsa, xabar faqat bayrog'i shu chaqiruvda o'rnatilgan chat_id larga yoziladi:
+    takroriy yoki boshqa worker bilan parallel chaqiruv eslatmani ikki marta navbatga qo'ymaydi.
+    """
+    markup_json = {}
+    await enqueue_rows([outbox_row(cid, message, markup_json) for cid, message in items], flags)
+
+async def enqueue_rows(rows, flags=()):
+    """enqueue_messages bilan bir xil, lekin tayyor outbox qatorlari bilan (OUTBOX_INSERT_SQL tartibida)."""
+    by_flag = {}
+    for flag, user_id, match_id in flags:
+        by_flag.setdefault((flag, match_id), []).append(user_id)
+    if not rows and not by_flag:
+        return
+    async with db_pool.write() as db:
+        if by_flag:
+            claimed = set()
+            for (flag, match_id), user_ids in by_flag.items():
+                for i in range(0, len(user_ids), NOTIFICATION_FLAG_CHUNK):
+                    chunk = user_ids[i:i + NOTIFICATION_FLAG_CHUNK]
+                    sql = NOTIFICATION_FLAG_SQL[flag].format(",".join("?" * len(chunk)))
+                    async with db.execute(sql, (match_id, *chunk)) as cur:
+                        claimed.update(r[0] for r in await cur.fetchall())
+            rows = [row for row in rows if row[0] in claimed]
+        await db.executemany(OUTBOX_INSERT_SQL, rows)
+    if rows:
+        outbox.notify()
+
+class OutboxDispatcher:
+    """Outbox jadvalini navbat bilan yuboradi; restartdan keyin qolgan joyidan davom etadi."""
+
+    def __init__(self, pool: DBPool, writer: BatchWriter, sender: Broadcaster):
+        self.pool = pool
+        self.writer = writer
+        self.sender = sender
+        self._wakeup = asyncio.Event()
+
+    def notify(self):
+        self._wakeup.set()
+
+    async def _claim(self):
+        async with self.pool.read() as db:
+            async with db.execute("""SELECT id, chat_id, text, parse_mode, reply_markup, media_type, media_file_id,
+                    disable_preview, attempts FROM outbox WHERE next_attempt_at <= ? ORDER BY id LIMIT ?""",
+                    (time.time(), OUTBOX_BATCH_SIZE)) as cur:
+                return await cur.fetchall()
+
+    @staticmethod
+    def _to_message(row, memo: dict = None) -> dict:
+        """memo: bir xil tarkibli qatorlar (masalan, bitta match eslatmasi) uchun bitta xabar obyekti."""
+        key = row[2:8]
+        if memo is not None and key in memo:
+            return memo[key]
+        text, parse_mode, reply_markup, media_type, media_file_id, disable_preview = key
+        message = {"text": text}
+        if parse_mode:
+            message["parse_mode"] = parse_mode
+        if reply_markup:
+            message["reply_markup"] = InlineKeyboardMarkup.de_json(json.loads(reply_markup), None)
+        if media_type:
+            message["media_type"] = media_type
+            message["media_file_id"] = media_file_id
+        if disable_preview:
+            message["disable_web_page_preview"] = True
+        if memo is not None:
+            memo[key] = message
+        return message
+
+    async def _dispatch(self, bot, rows):
+        # Bitta chatning xabarlari tartibini saqlash uchun chat bo'yicha guruhlash
+        groups = OrderedDict()
+        for row in rows:
+            groups.setdefault(row[1], []).append(row)
+
+        async def on_sent(chat_id):
+            for row in groups[chat_id]:
+                await self.writer.add("DELETE FROM outbox WHERE id = ?", (row[0],))
+
+        async def on_failed(chat_id, status):
+            if status in DEAD_CHAT_STATUSES:
+                # Chatga endi yetkazib bo'lmaydi: uning navbatdagi barcha xabarlarini tashlaymiz
+                await self.writer.add("DELETE FROM outbox WHERE chat_id = ?", (chat_id,))
+                return
+            if status not in RETRYABLE_STATUSES:
+                # BadRequest (masalan, "Can't parse entities") qayta urinishda ham muvaffaqiyatsiz bo'ladi
+                for row in groups[chat_id]:
+                    logger.error(f"Outbox xabari tashlab yuborildi (id {row[0]}, chat {chat_id}): {status}")
+                    await self.writer.add("DELETE FROM outbox WHERE id = ?", (row[0],))
+                return
+            for row in groups[chat_id]:
+                attempts = row[8] + 1
+                if attempts >= OUTBOX_MAX_ATTEMPTS:
+                    logger.error(f"Outbox xabari tashlab yuborildi (id {row[0]}, chat {chat_id}): {status}")
+                    await self.writer.add("DELETE FROM outbox WHERE id = ?", (row[0],))
+                else:
+                    await self.writer.add("UPDATE outbox SET attempts = ?, next_attempt_at = ? WHERE id = ?",
+                                          (attempts, time.time() + 30 * 2 ** attempts, row[0]))
+
+        memo = {}
+        deliveries = [(cid, [self._to_message(r, memo) for r in group]) for cid, group in groups.items()]
+        result = await self.sender.run(bot, deliveries, on_sent=on_sent, on_failed=on_failed)
+        # Keyingi claim shu qatorlarni qayta olmasligi uchun natijalarni darhol yozish
+        await self.writer.flush()
+        logger.info(f"Outbox: {result.sent} ta yuborildi, {result.failed} ta xato, {result.blocked} ta bloklangan")
+
+    async def run(self, bot):
+        while True:
+            self._wakeup.clear()
+            try:
+                rows = await self._claim()
+                if rows:
+                    await self._dispatch(bot, rows)
+                    continue
+            except Exception as e:
+                logger.exception(f"Outbox dispatcher xatosi: {e}")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), OUTBOX_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+
+outbox = OutboxDispatcher(db_pool, db_writer, broadcaster)
+
+# ========== JOBS ==========
+# Kechiktirilgan fon ishlari uchun SQLite navbati: run_at vaqti, backoff bilan qayta urinish,
+# har bir tur uchun parallellik chegarasi. Handlerlar idempotent bo'lishi kerak:
+# restart yoki xatodan keyin partiya qayta bajarilishi mumkin.
+JOB_POLL_INTERVAL = 5
+JOB_BACKOFF_BASE = 10
+JOB_BACKOFF_MAX = 30 * 60
+JOB_DRAIN_TIMEOUT = 15
+JOB_INSERT_SQL = """INSERT INTO jobs (type, payload, dedupe_key, run_at)
+    VALUES (?, ?, ?, ?) ON CONFLICT(dedupe_key) DO NOTHING"""
+
+class JobType(NamedTuple):
+    handler: object        # async handler(jobs: [(job_id, payload), ...])
+    concurrency: int
+    max_attempts: int
+    batch_size: int
+
+def job_row(job_type: str, payload: dict, delay: float = 0, dedupe_key: str = None) -> tuple:
+    return (job_type, json.dumps(payload, ensure_ascii=False), dedupe_key, time.time() + delay)
+
+class JobRunner:
+    def __init__(self, pool: DBPool, writer: BatchWriter):
+        self.pool = pool
+        self.writer = writer
+        self.types = {}
+        self._active = {}      # type -> ishlayotgan partiyalar soni
+        self._inflight = set() # ishlanayotgan job id lari
+        self._tasks = set()
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self.done = 0
+        self.failed = 0
+
+    def register(self, job_type: str, handler, concurrency: int = 1, max_attempts: int = 5, batch_size: int = 100):
+        self.types[job_type] = JobType(handler, concurrency, max_attempts, batch_size)
+        self._active[job_type] = 0
+
+    def notify(self):
+        self._wakeup.set()
+
+    async def enqueue(self, job_type: str, payload: dict, delay: float = 0, dedupe_key: str = None, db=None):
+        """Ishni navbatga qo'yadi; db berilsa, chaqiruvchining tranzaksiyasida yoziladi."""
+        row = job_row(job_type, payload, delay, dedupe_key)
+        if db is not None:
+            await db.execute(JOB_INSERT_SQL, row)
+        else:
+            async with self.pool.write() as conn:
+                await conn.execute(JOB_INSERT_SQL, row)
+            self.notify()
+
+    def enqueue_nowait(self, job_type: str, payload: dict, delay: float = 0, dedupe_key: str = None):
+        """Shoshilinch bo'lmagan ishlar uchun: BatchWriter orqali partiyada yoziladi."""
+        self.writer.add_nowait(JOB_INSERT_SQL, job_row(job_type, payload, delay, dedupe_key))
+
+    async def _claim(self, job_type: str, limit: int):
+        async with self.pool.read() as db:
+            async with db.execute("SELECT id, payload, attempts FROM jobs WHERE type = ? AND run_at <= ? ORDER BY run_at LIMIT ?",
+                                  (job_type, time.time(), limit + len(self._inflight))) as cur:
+                rows = await cur.fetchall()
+        return [r for r in rows if r[0] not in self._inflight][:limit]
+
+    async def _execute(self, job_type: str, rows):
+        jt = self.types[job_type]
+        ids = [r[0] for r in rows]
+        try:
+            await jt.handler([(r[0], json.loads(r[1])) for r in rows])
+        except Exception as e:
+            logger.exception(f"Job xatosi ({job_type}, {len(rows)} ta): {e}")
+            now = time.time()
+            retry, dead = [], []
+            for job_id, _, attempts in rows:
+                if attempts + 1 >= jt.max_attempts:
+                    dead.append((job_id,))
+                else:
+                    delay = min(JOB_BACKOFF_BASE * 2 ** attempts, JOB_BACKOFF_MAX) * random.uniform(0.8, 1.2)
+                    retry.append((now + delay, str(e)[:500], job_id))
+            async with self.pool.write() as db:
+                await db.executemany("UPDATE jobs SET attempts = attempts + 1, run_at = ?, last_error = ? WHERE id = ?", retry)
+                await db.executemany("DELETE FROM jobs WHERE id = ?", dead)
+            self.failed += len(dead)
+            if dead:
+                logger.error(f"Job tashlandi ({job_type}): {len(dead)} ta, {jt.max_attempts} urinishdan keyin")
+        else:
+            async with self.pool.write() as db:
+                await db.executemany("DELETE FROM jobs WHERE id = ?", [(i,) for i in ids])
+            self.done += len(ids)
+        finally:
+            self._inflight.difference_update(ids)
+            self._active[job_type] -= 1
+            self._wakeup.set()
+
+    async def _poll(self):
+        for job_type, jt in self.types.items():
+            while self._active[job_type] < jt.concurrency:
+                rows = await self._claim(job_type, jt.batch_size)
+                if not rows:
+                    break
+                self._inflight.update(r[0] for r in rows)
+                self._active[job_type] += 1
+                task = asyncio.create_task(self._execute(job_type, rows))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+
+    async def run(self):
+        while not self._stopping:
+            self._wakeup.clear()
+            try:
+                await self._poll()
+            except Exception as e:
+                logger.exception(f"Job runner xatosi: {e}")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), JOB_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+
+    async def drain(self, timeout: float = JOB_DRAIN_TIMEOUT):
+        """Yangi ish olishni to'xtatadi va boshlangan partiyalarni kutadi."""
+        self._stopping = True
+        self._wakeup.set()
+        if self._tasks:
+            done, pending = await asyncio.wait(set(self._tasks), timeout=timeout)
+            for task in pending:
+                task.cancel()
+            if pending:
+                logger.warning(f"Job drain: {len(pending)} ta partiya to'xtatildi, restartdan keyin qayta bajariladi")
+
+    async def stats(self) -> dict:
+        now = time.time()
+        async with self.pool.read() as db:
+            async with db.execute("""SELECT type, COUNT(*), SUM(run_at <= ?), MIN(CASE WHEN run_at <= ? THEN run_at END)
+                    FROM jobs GROUP BY type""", (now, now)) as cur:
+                rows = await cur.fetchall()
+        per_type = {t: {"queued": q, "due": d or 0, "lag": now - oldest if oldest is not None else 0.0} for t, q, d, oldest in rows}
+        return {"types": per_type, "running": sum(self._active.values()), "done": self.done, "failed": self.failed}
+
+job_runner = JobRunner(db_pool, db_writer)
+
+async def supervised(name: str, factory, restart_delay: float = 5):
+    """Fon servisini ishlatadi; kutilmagan xatodan keyin qayta ishga tushiradi."""
     while True:
         try:
-            subs = await get_all_subscriptions()
-            groups = {}
-            for s in subs:
-                uid, mid, tstr, home, away, league, n1, n15, nl = s
-                if mid not in groups:
-                    groups[mid] = {"time": datetime.strptime(tstr, "%Y-%m-%dT%H:%M:%SZ"), "home": home, "away": away, "league": league,
-                                   "users": [], "n1_flag": False, "n15_flag": False, "nl_flag": False}
-                groups[mid]["users"].append({"id": uid, "n1": n1, "n15": n15, "nl": nl})
-            for mid, g in groups.items():
-                delta = (g["time"] - datetime.utcnow()).total_seconds() / 60
-                if not g["n1_flag"] and any(not u["n1"] for u in g["users"]):
-                    if 55 <= delta <= 65:
-                        for u in g["users"]:
-                            if not u["n1"]:
-                                try:
-                                    await app.bot.send_message(u["id"],
-                                        f"⏰ **1 soat qoldi!**\n\n{g['home']} – {g['away']}\n🕒 {g['time'].strftime('%d.%m.%Y %H:%M')} UTC+0\n\n📋 Tarkiblar eʼlon qilinishi kutilmoqda.",
-                                        parse_mode="Markdown")
-                                    await update_notification_flags(u["id"], mid, one_hour=True)
-                                except Exception as e:
-                                    logger.error(f"1h notification error: {e}")
-                        g["n1_flag"] = True
-                        if not g["nl_flag"] and any(not u["nl"] for u in g["users"]):
-                            lu = await fetch_match_lineups(mid)
-                            if lu and (lu['home_lineup'] or lu['away_lineup']):
-                                lineup_msg = format_lineups(lu)
-                                links = generate_match_links(mid, g['home'], g['away'], g['league'])
-                                links_msg = format_links_message(links)
-                                for u in g["users"]:
-                                    if not u["nl"]:
-                                        try:
-                                            await app.bot.send_message(u["id"], lineup_msg, parse_mode="Markdown")
-                                            await app.bot.send_message(u["id"], links_msg, parse_mode="Markdown", disable_web_page_preview=True)
-                                            await update_notification_flags(u["id"], mid, lineups=True)
-                                        except Exception as e:
-                                            logger.error(f"Lineups notification error: {e}")
-                            else:
-                                links = generate_match_links(mid, g['home'], g['away'], g['league'])
-                                msg = f"📋 **{g['home']} – {g['away']}**\n\n❌ Tarkiblar API orqali e'lon qilinmagan.\n🔗 Quyidagi ishonchli saytlarda tarkiblarni ko‘ring:\n\n"
-                                for name, url in links[:4]:
-                                    msg += f"• [{name}]({url})\n"
-                                for u in g["users"]:
-                                    if not u["nl"]:
-                                        try:
-                                            await app.bot.send_message(u["id"], msg, parse_mode="Markdown", disable_web_page_preview=True)
-                                            await update_notification_flags(u["id"], mid, lineups=True)
-                                        except Exception as e:
-                                            logger.error(f"Lineups notification error: {e}")
-                            g["nl_flag"] = True
-                if not g["n15_flag"] and any(not u["n15"] for u in g["users"]):
-                    if 10 <= delta <= 20:
-                        links = generate_match_links(mid, g['home'], g['away'], g['league'])
-                        msg = f"⏳ **15 daqiqa qoldi!**\n\n{g['home']} – {g['away']}\n🕒 {g['time'].strftime('%d.%m.%Y %H:%M')} UTC+0\n\n🔗 Jonli tarkiblar va statistika:\n\n"
-                        for name, url in links[:5]:
-                            msg += f"• [{name}]({url})\n"
-                        for u in g["users"]:
-                            if not u["n15"]:
-                                try:
-                                    await app.bot.send_message(u["id"], msg, parse_mode="Markdown", disable_web_page_preview=True)
-                                    await update_notification_flags(u["id"], mid, fifteen_min=True)
-                                except Exception as e:
-                                    logger.error(f"15m notification error: {e}")
-                        g["n15_flag"] = True
+            await factory()
+            return
         except Exception as e:
-            logger.exception(f"Scheduler xatosi: {e}")
-        await asyncio.sleep(60)
+            logger.exception(f"Servis {name} yiqildi, {restart_delay} s dan keyin qayta ishga tushadi: {e}")
+            await asyncio.sleep(restart_delay)
+
+job_runner.register("referral_notification", referral_notification_job, concurrency=2, batch_size=200)
+job_runner.register("aisports_bonus", aisports_bonus_job, concurrency=1, batch_size=AISPORTS_BATCH_SIZE)
+
+# ========== NOTIFICATION SCHEDULER ==========
+class NotificationPayload(NamedTuple):
+    """Bitta match uchun bir marta tayyorlanadigan o'zgarmas bildirishnoma; barcha obunachilarga bir xil."""
+    text: str
+    reply_markup: Optional[InlineKeyboardMarkup] = None
+    parse_mode: str = "Markdown"
+    disable_web_page_preview: bool = True
+
+    def outbox_columns(self) -> tuple:
+        """outbox qatorining chat_id dan keyingi ustunlari (markup JSON bir marta seriyalanadi)."""
+        return outbox_row(0, self._asdict())[1:]
+
+async def render_one_hour_reminder(mid, g) -> NotificationPayload:
+    return NotificationPayload(
+        f"⏰ **1 soat qoldi!**\n\n{g['home']} – {g['away']}\n🕒 {g['time'].strftime('%d.%m.%Y %H:%M')} UTC+0\n\n📋 Tarkiblar eʼlon qilinishi kutilmoqda.")
+
+async def render_lineup_notification(mid, g) -> NotificationPayload:
+    """Tarkiblar va havolalar bitta xabarda: havolalar matn o'rniga URL tugmalarda."""
+    # Tarkiblar o'yindan ~1 soat oldin e'lon qilinadi – eski nusxa emas, yangisi kerak
+    lu = await fetch_match_lineups(mid, allow_stale=False)
+    links = generate_match_links(mid, g['home'], g['away'], g['league'])
+    if lu and (lu['home_lineup'] or lu['away_lineup']):
+        return NotificationPayload(format_lineups(lu) + "\n🔗 **Ishonchli saytlarda kuzating:**",
+                                   build_links_keyboard(links))
+    return NotificationPayload(
+        f"📋 **{g['home']} – {g['away']}**\n\n❌ Tarkiblar API orqali e'lon qilinmagan.\n🔗 Quyidagi ishonchli saytlarda tarkiblarni ko‘ring:",
+        build_links_keyboard(links, limit=4))
+
+async def render_fifteen_min_reminder(mid, g) -> NotificationPayload:
+    links = generate_match_links(mid, g['home'], g['away'], g['league'])
+    msg = f"⏳ **15 daqiqa qoldi!**\n\n{g['home']} – {g['away']}\n🕒 {g['time'].strftime('%d.%m.%Y %H:%M')} UTC+0\n\n🔗 Jonli tarkiblar va statistika:\n\n"
+    for name, url in links[:5]:
+        msg += f"• [{name}]({url})\n"
+    return NotificationPayload(msg)
+
+async def enqueue_notification(match_id: int, flag: str, payload: NotificationPayload, users):
+    columns = payload.outbox_columns()
+    await enqueue_rows([(uid, *columns) for uid in users], flags=[(flag, uid, match_id) for uid in users])
+
+# Eslatma turi -> (matchgacha qolgan vaqt, [(bayroq, render qiluvchi), ...])
+REMINDERS = {
+    "one_hour": (timedelta(minutes=60), (("one_hour", render_one_hour_reminder), ("lineups", render_lineup_notification))),
+    "fifteen_min": (timedelta(minutes=15), (("fifteen_min", render_fifteen_min_reminder),)),
+}
+REMINDER_MAX_LATENESS = 300  # soniya; shundan kech qolgan eslatma yuborilmaydi
+
+class ReminderWheel:
+    """Eslatma muddatlari min-heap'i: keyingi muddat kelguncha uxlaydi, polling yo'q."""
+
+    def __init__(self, reminders: dict):
+        self.reminders = reminders
+        self._heap = []
+        self._scheduled = {}  # (match_id, kind) -> deadline
+        self._changed = asyncio.Event()
+
+    def schedule_match(self, match_id: int, match_time: datetime):
+        """match_time – naive UTC vaqt."""
+        kickoff = match_time.replace(tzinfo=timezone.utc).timestamp()
+        for kind, (offset, _) in self.reminders.items():
+            deadline = kickoff - offset.total_seconds()
+            if self._scheduled.get((match_id, kind)) == deadline:
+                continue
+            self._scheduled[(match_id, kind)] = deadline
+            heapq.heappush(self._heap, (deadline, match_id, kind))
+        self._changed.set()
+
+    def cancel_match(self, match_id: int):
+        # Heap'dagi yozuvlar chiqarilganda e'tiborsiz qoldiriladi
+        for kind in self.reminders:
+            self._scheduled.pop((match_id, kind), None)
+        if len(self._heap) > 2 * len(self._scheduled) + 100:
+            self._heap = [e for e in self._heap if self._scheduled.get((e[1], e[2])) == e[0]]
+            heapq.heapify(self._heap)
+
+    async def hydrate(self):
+        since = datetime.utcnow() - timedelta(seconds=REMINDER_MAX_LATENESS)
+        for mid, match_time in await get_upcoming_match_times(since):
+            self.schedule_match(mid, match_time)
+        logger.info(f"Eslatmalar yuklandi: {len(self._scheduled)} ta muddat")
+
+    async def _fire(self, match_id: int, kind: str):
+        for flag, render in self.reminders[kind][1]:
+            g = await get_pending_reminder(match_id, flag)
+            if g:
+                await enqueue_notification(match_id, flag, await render(match_id, g), g["users"])
+
+    async def run(self):
+        while True:
+            self._changed.clear()
+            now = time.time()
+            due = []
+            while self._heap and self._heap[0][0] <= now:
+                deadline, mid, kind = heapq.heappop(self._heap)
+                if self._scheduled.get((mid, kind)) != deadline:
+                    continue
+                del self._scheduled[(mid, kind)]
+                if now - deadline > REMINDER_MAX_LATENESS:
+                    logger.warning(f"Eslatma o'tkazib yuborildi (match {mid}, {kind}): {int(now - deadline)} s kech")
+                    continue
+                due.append((mid, kind))
+            for mid, kind in due:
+                try:
+                    await self._fire(mid, kind)
+                except Exception as e:
+                    logger.exception(f"Scheduler xatosi (match {mid}, {kind}): {e}")
+            timeout = max(0.0, self._heap[0][0] - time.time()) if self._heap else None
+            try:
+                await asyncio.wait_for(self._changed.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+reminder_wheel = ReminderWheel(REMINDERS)
+
+async def notification_scheduler(app: Application):
+    await reminder_wheel.hydrate()
+    await reminder_wheel.run()
+
+# ---------- boshqa workerlardan keladigan hodisalar ----------
+async def _on_subscription_event(payload: dict):
+    if coordinator.is_leader:
+        reminder_wheel.schedule_match(payload["match_id"], datetime.strptime(payload["match_time"], MATCH_TIME_FORMAT))
+
+async def _on_admins_event(payload: dict):
+    await load_admin_ids()
+
+coordinator.on("match", match_cache.apply_remote)
+coordinator.on("match_view", _on_match_view_event)
+coordinator.on("league", _on_league_event)
+coordinator.on("admins", _on_admins_event)
+coordinator.on("subscription", _on_subscription_event)
+coordinator.on("broadcast_cancel", _on_broadcast_cancel_event)
 
 # ========== ADMIN BUYRUQLARI (COMMAND HANDLERS) ==========
+@admin_only()
 async def add_analysis_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     u = update.effective_user
-    if not await is_admin(u.id):
-        await update.message.reply_text("❌ Siz admin emassiz.")
-        return
     if len(context.args) < 2:
         await update.message.reply_text(
             "❌ Ishlatish: `/addanalysis <match_id> <tahlil matni>`\n"
@@ -1066,27 +2767,15 @@ async def add_analysis_command(update: Update, context: ContextTypes.DEFAULT_TYP
         return
     await update_analysis_text(match_id, text, u.id)
     await update.message.reply_text(f"✅ Tahlil matni qoʻshildi (Match ID: {match_id}).")
-    subs = await get_subscribers_for_match(match_id)
-    if subs:
-        sent = 0
-        safe_text = escape_markdown(text, version=2)
-        buttons = [[InlineKeyboardButton("📋 Tahlilni ko‘rish", callback_data=f"match_{match_id}")]]
-        keyboard = InlineKeyboardMarkup(buttons)
-        for sid in subs:
-            try:
-                await context.bot.send_message(sid,
-                    f"📝 **Oʻyin tahlili yangilandi!**\n\n🆔 Match ID: `{match_id}`\n📊 **Yangi tahlil:**\n{safe_text}",
-                    parse_mode="Markdown", reply_markup=keyboard)
-                sent += 1
-            except Exception as e:
-                logger.error(f"Tahlil bildirishnomasi xatosi (user {sid}): {e}")
-        await update.message.reply_text(f"📢 {sent} ta obunachiga bildirishnoma yuborildi.")
+    safe_text = escape_markdown(text, version=2)
+    buttons = [[InlineKeyboardButton("📋 Tahlilni ko‘rish", callback_data=f"match_{match_id}")]]
+    await broadcast_to_subscribers(update, context, match_id, [{
+        "text": f"📝 **Oʻyin tahlili yangilandi!**\n\n🆔 Match ID: `{match_id}`\n📊 **Yangi tahlil:**\n{safe_text}",
+        "parse_mode": "Markdown", "reply_markup": InlineKeyboardMarkup(buttons)}])
 
+@admin_only()
 async def add_url_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     u = update.effective_user
-    if not await is_admin(u.id):
-        await update.message.reply_text("❌ Siz admin emassiz.")
-        return
     if len(context.args) != 2:
         await update.message.reply_text(
             "❌ Ishlatish: `/addurl <match_id> <havola>`\n"
@@ -1104,33 +2793,21 @@ async def add_url_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     await update_analysis_url(match_id, url, u.id)
     await update.message.reply_text(f"✅ Toʻliq tahlil havolasi qoʻshildi (Match ID: {match_id}).\n🔗 {url}")
-    subs = await get_subscribers_for_match(match_id)
-    if subs:
-        sent = 0
-        analysis_row = await get_analysis(match_id)
-        analysis_text = analysis_row[0] if analysis_row else "Tahlil kutilmoqda"
-        safe_text = escape_markdown(analysis_text, version=2)
-        buttons = [
-            [InlineKeyboardButton("📋 Tahlilni ko‘rish", callback_data=f"match_{match_id}")],
-            [InlineKeyboardButton("🔗 To‘liq tahlil", url=url)]
-        ]
-        keyboard = InlineKeyboardMarkup(buttons)
-        for sid in subs:
-            try:
-                await context.bot.send_message(sid,
-                    f"🔗 **Oʻyin uchun toʻliq tahlil havolasi qoʻshildi!**\n\n"
-                    f"🆔 Match ID: `{match_id}`\n📊 **Tahlil:**\n{safe_text}",
-                    parse_mode="Markdown", reply_markup=keyboard)
-                sent += 1
-            except Exception as e:
-                logger.error(f"URL bildirishnomasi xatosi (user {sid}): {e}")
-        await update.message.reply_text(f"📢 {sent} ta obunachiga bildirishnoma yuborildi.")
+    analysis_row = await get_analysis(match_id)
+    analysis_text = analysis_row[0] if analysis_row else "Tahlil kutilmoqda"
+    safe_text = escape_markdown(analysis_text, version=2)
+    buttons = [
+        [InlineKeyboardButton("📋 Tahlilni ko‘rish", callback_data=f"match_{match_id}")],
+        [InlineKeyboardButton("🔗 To‘liq tahlil", url=url)]
+    ]
+    await broadcast_to_subscribers(update, context, match_id, [{
+        "text": f"🔗 **Oʻyin uchun toʻliq tahlil havolasi qoʻshildi!**\n\n"
+                f"🆔 Match ID: `{match_id}`\n📊 **Tahlil:**\n{safe_text}",
+        "parse_mode": "Markdown", "reply_markup": InlineKeyboardMarkup(buttons)}])
 
+@admin_only()
 async def add_full_analysis_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     u = update.effective_user
-    if not await is_admin(u.id):
-        await update.message.reply_text("❌ Siz admin emassiz.")
-        return
     if len(context.args) < 3:
         await update.message.reply_text(
             "❌ Ishlatish: `/addfull <match_id> <tahlil matni> <havola>`\n"
@@ -1152,33 +2829,22 @@ async def add_full_analysis_command(update: Update, context: ContextTypes.DEFAUL
         return
     await add_full_analysis(match_id, text, url, u.id)
     await update.message.reply_text(f"✅ Tahlil va havola qoʻshildi (Match ID: {match_id}).\n🔗 {url}")
-    subs = await get_subscribers_for_match(match_id)
-    if subs:
-        sent = 0
-        safe_text = escape_markdown(text, version=2)
-        buttons = [
-            [InlineKeyboardButton("📋 Tahlilni ko‘rish", callback_data=f"match_{match_id}")],
-            [InlineKeyboardButton("🔗 To‘liq tahlil", url=url)]
-        ]
-        keyboard = InlineKeyboardMarkup(buttons)
-        for sid in subs:
-            try:
-                await context.bot.send_message(sid,
-                    f"📝 **Oʻyin tahlili va toʻliq tahlil havolasi qoʻshildi!**\n\n"
-                    f"🆔 Match ID: `{match_id}`\n📊 **Tahlil:**\n{safe_text}",
-                    parse_mode="Markdown", reply_markup=keyboard)
-                sent += 1
-            except Exception as e:
-                logger.error(f"Bildirishnoma xatosi (user {sid}): {e}")
-        await update.message.reply_text(f"📢 {sent} ta obunachiga bildirishnoma yuborildi.")
+    safe_text = escape_markdown(text, version=2)
+    buttons = [
+        [InlineKeyboardButton("📋 Tahlilni ko‘rish", callback_data=f"match_{match_id}")],
+        [InlineKeyboardButton("🔗 To‘liq tahlil", url=url)]
+    ]
+    await broadcast_to_subscribers(update, context, match_id, [{
+        "text": f"📝 **Oʻyin tahlili va toʻliq tahlil havolasi qoʻshildi!**\n\n"
+                f"🆔 Match ID: `{match_id}`\n📊 **Tahlil:**\n{safe_text}",
+        "parse_mode": "Markdown", "reply_markup": InlineKeyboardMarkup(buttons)}])
 
 # ========== MEDIA VA TUGMALAR UCHUN CONVERSATION HANDLERS ==========
 MEDIA_MATCH_ID, MEDIA_FILE, MEDIA_CAPTION = range(3)
 BUTTON_MATCH_ID, BUTTON_ROW, BUTTON_COL, BUTTON_TEXT, BUTTON_TYPE, BUTTON_DATA = range(6)
 
+@admin_only(deny_text=None, deny_result=ConversationHandler.END)
 async def add_match_media_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not await is_admin(update.effective_user.id):
-        return ConversationHandler.END
     await update.message.reply_text("O‘yin Match ID sini kiriting:")
     return MEDIA_MATCH_ID
 
@@ -1188,12 +2854,9 @@ async def add_match_media_get_id(update: Update, context: ContextTypes.DEFAULT_T
     except:
         await update.message.reply_text("❌ Noto‘g‘ri format. Match ID raqam bo‘lishi kerak.")
         return MEDIA_MATCH_ID
-    async with aiosqlite.connect(DB_PATH) as db:
-        async with db.execute("SELECT match_id FROM match_analyses WHERE match_id = ?", (match_id,)) as cur:
-            row = await cur.fetchone()
-            if not row:
-                await update.message.reply_text("❌ Bunday Match ID topilmadi. Avval tahlil yarating.")
-                return MEDIA_MATCH_ID
+    if not await analysis_exists(match_id):
+        await update.message.reply_text("❌ Bunday Match ID topilmadi. Avval tahlil yarating.")
+        return MEDIA_MATCH_ID
     context.user_data['media_match_id'] = match_id
     await update.message.reply_text("Endi rasm, hujjat (APK) yoki videoni yuboring:")
     return MEDIA_FILE
@@ -1249,9 +2912,8 @@ add_media_conv = ConversationHandler(
     fallbacks=[]
 )
 
+@admin_only(deny_text=None, deny_result=ConversationHandler.END)
 async def add_button_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not await is_admin(update.effective_user.id):
-        return ConversationHandler.END
     await update.message.reply_text("O‘yin Match ID sini kiriting:")
     return BUTTON_MATCH_ID
 
@@ -1328,9 +2990,8 @@ add_button_conv = ConversationHandler(
     fallbacks=[]
 )
 
+@admin_only(deny_text=None)
 async def list_match_buttons(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not await is_admin(update.effective_user.id):
-        return
     if len(context.args) != 1:
         await update.message.reply_text("Ishlatish: /listmatchbuttons <match_id>")
         return
@@ -1348,9 +3009,8 @@ async def list_match_buttons(update: Update, context: ContextTypes.DEFAULT_TYPE)
         msg += f"ID: {b[0]} | Qator {b[1]}, Ustun {b[2]}\n   [{b[3]}] ({b[4]}: {b[5]})\n"
     await update.message.reply_text(msg, parse_mode="Markdown")
 
+@admin_only(deny_text=None)
 async def remove_match_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not await is_admin(update.effective_user.id):
-        return
     if len(context.args) != 2:
         await update.message.reply_text("Ishlatish: /removematchbutton <match_id> <button_id>")
         return
@@ -1363,10 +3023,9 @@ async def remove_match_button(update: Update, context: ContextTypes.DEFAULT_TYPE
     await delete_match_button(button_id, match_id)
     await update.message.reply_text("✅ Tugma o‘chirildi.")
 
+@admin_only(deny_text=None)
 async def edit_match_text_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     u = update.effective_user
-    if not await is_admin(u.id):
-        return
     if len(context.args) < 2:
         await update.message.reply_text("Ishlatish: /editmatchtext <match_id> <yangi matn>")
         return
@@ -1378,44 +3037,36 @@ async def edit_match_text_command(update: Update, context: ContextTypes.DEFAULT_
         return
     await update_analysis_text(match_id, new_text, u.id)
     await update.message.reply_text(f"✅ Tahlil matni yangilandi (Match ID: {match_id}).")
-    subs = await get_subscribers_for_match(match_id)
-    if subs:
-        safe_text = escape_markdown(new_text, version=2)
-        for sid in subs:
-            try:
-                await context.bot.send_message(sid,
-                    f"📝 **Oʻyin tahlili yangilandi!**\n\n🆔 Match ID: `{match_id}`\n📊 **Yangi tahlil:**\n{safe_text}",
-                    parse_mode="Markdown")
-            except Exception as e:
-                logger.error(f"Bildirishnoma xatosi (user {sid}): {e}")
+    safe_text = escape_markdown(new_text, version=2)
+    await broadcast_to_subscribers(update, context, match_id, [{
+        "text": f"📝 **Oʻyin tahlili yangilandi!**\n\n🆔 Match ID: `{match_id}`\n📊 **Yangi tahlil:**\n{safe_text}",
+        "parse_mode": "Markdown"}])
 
 # ========== BOSHQA ADMIN BUYRUQLARI ==========
+@admin_only()
 async def add_admin_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     u = update.effective_user
-    if not await is_admin(u.id): return await update.message.reply_text("❌ Siz admin emassiz.")
     if len(context.args) != 1: return await update.message.reply_text("❌ Ishlatish: `/addadmin 123456789`", parse_mode="Markdown")
     try: new = int(context.args[0])
     except: return await update.message.reply_text("❌ ID raqam boʻlishi kerak.")
-    if await is_admin(new): return await update.message.reply_text("⚠️ Bu foydalanuvchi allaqachon admin.")
+    if is_admin(new): return await update.message.reply_text("⚠️ Bu foydalanuvchi allaqachon admin.")
     if await add_admin(new, u.id):
         await update.message.reply_text(f"✅ Foydalanuvchi {new} admin qilindi.")
     else:
         await update.message.reply_text("❌ Xatolik yuz berdi.")
 
+@admin_only()
 async def remove_admin_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    u = update.effective_user
-    if not await is_admin(u.id): return await update.message.reply_text("❌ Siz admin emassiz.")
     if len(context.args) != 1: return await update.message.reply_text("❌ Ishlatish: `/removeadmin 123456789`", parse_mode="Markdown")
     try: aid = int(context.args[0])
     except: return await update.message.reply_text("❌ ID raqam boʻlishi kerak.")
     if aid == 6935090105: return await update.message.reply_text("❌ Asosiy adminni o‘chirib bo‘lmaydi.")
-    if not await is_admin(aid): return await update.message.reply_text("⚠️ Bu foydalanuvchi admin emas.")
+    if not is_admin(aid): return await update.message.reply_text("⚠️ Bu foydalanuvchi admin emas.")
     await remove_admin(aid)
     await update.message.reply_text(f"✅ Admin {aid} olib tashlandi.")
 
+@admin_only()
 async def list_admins_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    u = update.effective_user
-    if not await is_admin(u.id): return await update.message.reply_text("❌ Siz admin emassiz.")
     admins = await get_all_admins()
     if not admins: return await update.message.reply_text("📭 Adminlar ro'yxati bo'sh.")
     text = "👑 **Adminlar:**\n\n"
@@ -1424,12 +3075,13 @@ async def list_admins_command(update: Update, context: ContextTypes.DEFAULT_TYPE
         text += f"• `{aid}` – qo'shdi: `{added_by}`, {dt}\n"
     await update.message.reply_text(text, parse_mode="Markdown")
 
+@admin_only()
 async def admin_stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    u = update.effective_user
-    if not await is_admin(u.id): return await update.message.reply_text("❌ Siz admin emassiz.")
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with db_pool.read() as db:
         async with db.execute("SELECT COUNT(*) FROM users") as cur:
             users = (await cur.fetchone())[0]
+        async with db.execute("SELECT COUNT(*) FROM users WHERE is_active = 0") as cur:
+            inactive = (await cur.fetchone())[0]
         async with db.execute("SELECT COUNT(*) FROM referrals") as cur:
             refs = (await cur.fetchone())[0]
         async with db.execute("SELECT SUM(balance) FROM users") as cur:
@@ -1438,8 +3090,39 @@ async def admin_stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE
             wd_cnt = (await cur.fetchone())[0]
         async with db.execute("SELECT SUM(amount) FROM withdrawals WHERE status='completed'") as cur:
             wd_sum = (await cur.fetchone())[0] or 0
-    text = f"📊 **Bot statistikasi**\n\n👥 Foydalanuvchilar: {users}\n🔗 Referallar: {refs}\n💰 Jami balans: {bal:,} soʻm\n💸 Yechimlar soni: {wd_cnt}\n💵 Jami yechilgan: {wd_sum:,} soʻm"
-    await update.message.reply_text(text, parse_mode="Markdown")
+    api = api_limiter.stats()
+    mc = match_cache.stats()
+    jobs = await job_runner.stats()
+    role = "leader" if coordinator.is_leader else "follower"
+    text = f"📊 **Bot statistikasi**\n\n👥 Foydalanuvchilar: {users}\n🚫 Botni bloklagan: {inactive}\n🔗 Referallar: {refs}\n💰 Jami balans: {bal:,} soʻm\n💸 Yechimlar soni: {wd_cnt}\n💵 Jami yechilgan: {wd_sum:,} soʻm"
+    text += (f"\n\n🌐 **API limiter**\n📥 Navbatda: {api['queue_depth']}\n✅ So'rovlar: {api['acquired']}\n"
+             f"⏱ Kutish: o'rtacha {api['avg_wait']:.1f} s, max {api['max_wait']:.1f} s")
+    text += (f"\n\n🗂 **Match kesh** ({mc['size']} ta)\n✅ Hit: {mc['hits']} | ♻️ Stale: {mc['stale_hits']} | "
+             f"❌ Miss: {mc['misses']} | 🧹 Evict: {mc['evictions']}")
+    text += f"\n\n🖥 Worker: `{WORKER_ID}` ({role}, {COORDINATION_BACKEND})"
+    text += f"\n\n🧰 **Fon ishlari**\n▶️ Ishlayapti: {jobs['running']} | ✅ Bajarildi: {jobs['done']} | ❌ Tashlandi: {jobs['failed']}"
+    for job_type, js in sorted(jobs["types"].items()):
+        text += f"\n• `{job_type}`: navbatda {js['queued']}, vaqti kelgan {js['due']}, kechikish {js['lag']:.0f} s"
+    await update.effective_message.reply_text(text, parse_mode="Markdown")
+
+@admin_only()
+async def cancel_broadcast_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not context.args:
+        if len(broadcast_jobs) == 1:
+            job_id = next(iter(broadcast_jobs))
+        else:
+            running = "\n".join(f"• `{j.job_id}` – match `{j.match_id}`" for j in broadcast_jobs.values())
+            return await update.message.reply_text(
+                "❌ Ishlatish: `/cancel <job_id>`" + (f"\n\n📤 Ishlayotgan tarqatmalar:\n{running}" if running else ""),
+                parse_mode="Markdown")
+    else:
+        job_id = context.args[0].lstrip("#")
+    if cancel_broadcast_job(job_id):
+        await update.message.reply_text(f"⛔ #{job_id} to'xtatilmoqda...")
+    else:
+        # Tarqatma boshqa workerda ishlayotgan bo'lishi mumkin
+        coordinator.publish("broadcast_cancel", {"job_id": job_id})
+        await update.message.reply_text(f"⛔ #{job_id} uchun bekor qilish so'rovi yuborildi.")
 
 async def test_api(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not FOOTBALL_DATA_KEY:
@@ -1454,26 +3137,142 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("Quyidagi chempionatlardan birini tanlang:", reply_markup=get_leagues_keyboard())
 
 # ========== WEB SERVER ==========
+# WEBHOOK_URL berilsa bot webhook rejimida ishlaydi (masalan https://bot.example.com),
+# aks holda long polling. WEBHOOK_SECRET Telegram yuboradigan secret token bilan solishtiriladi;
+# berilmasa BOT_TOKEN dan hosil qilinadi – barcha workerlarda bir xil, tashqaridan taxmin qilib bo'lmaydi.
+# Diqqat: ConversationHandler holati, user_data va chat ichidagi tartib har bir worker xotirasida.
+# Bir nechta worker webhook qabul qilsa, load balancer bitta chatning barcha update'larini doim
+# bitta workerga yo'naltirishi (sticky, chat_id bo'yicha) shart; aks holda bitta workerga webhook bering.
+WEBHOOK_URL = os.environ.get("WEBHOOK_URL")
+WEBHOOK_PATH = os.environ.get("WEBHOOK_PATH", "/telegram")
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET") or hmac.new(
+    os.environ.get("BOT_TOKEN", "").encode(), b"telegram-webhook", "sha256").hexdigest()
+bot_application: Optional[Application] = None
+
 async def health_check(request):
     return web.Response(text="✅ Bot ishlamoqda (Full version with admin menu)")
 
+async def telegram_webhook(request):
+    if not hmac.compare_digest(request.headers.get("X-Telegram-Bot-Api-Secret-Token", ""), WEBHOOK_SECRET):
+        return web.Response(status=403)
+    application = bot_application
+    if application is None or not application.running:
+        return web.Response(status=503)
+    try:
+        update = Update.de_json(await request.json(), application.bot)
+    except Exception as e:
+        logger.warning(f"Webhook: noto'g'ri update: {e}")
+        return web.Response(status=400)
+    await application.update_queue.put(update)
+    return web.Response()
+
 async def run_web_server():
     app = web.Application()
     app.router.add_get("/", health_check)
+    if WEBHOOK_URL:
+        app.router.add_post(WEBHOOK_PATH, telegram_webhook)
     port = int(os.environ.get("PORT", 8080))
     runner = web.AppRunner(app)
     await runner.setup()
     await web.TCPSite(runner, "0.0.0.0", port).start()
     logger.info(f"Web server port {port} da ishga tushdi")
 
+# ========== UPDATE PROCESSOR ==========
+UPDATE_CONCURRENCY = int(os.environ.get("UPDATE_CONCURRENCY", 32))
+UPDATE_MAX_PENDING = int(os.environ.get("UPDATE_MAX_PENDING", 1024))
+
+class PerChatUpdateProcessor(BaseUpdateProcessor):
+    """Turli chatlar yangilanishlarini parallel, bitta chat ichidagilarini kelish tartibida ishlaydi.
+
+    Haqiqiy parallellik chat qulfidan keyin olinadigan _workers semafori bilan, shu tufayli bitta
+    chatning navbati boshqa chatlarning ishchi o'rinlarini band qilmaydi. ConversationHandler
+    oqimlari chat bo'yicha ketma-ket qoladi. Kutayotgan yangilanishlar sonini bu yerda emas,
+    BoundedUpdateQueue cheklaydi: PTB har bir yangilanish uchun task'ni asosiy semafordan oldin
+    yaratadi.
+    """
+
+    def __init__(self, max_concurrent_updates: int, max_pending: int):
+        super().__init__(max(max_pending, max_concurrent_updates))
+        self._workers = asyncio.BoundedSemaphore(max_concurrent_updates)
+        self._chats = {}  # chat_id -> [Lock, shu chatdagi yangilanishlar soni]
+
+    @staticmethod
+    def _chat_key(update: object) -> Optional[int]:
+        if not isinstance(update, Update):
+            return None
+        if update.effective_chat:
+            return update.effective_chat.id
+        if update.effective_user:
+            return update.effective_user.id
+        return None
+
+    async def do_process_update(self, update: object, coroutine) -> None:
+        key = self._chat_key(update)
+        if key is None:
+            async with self._workers:
+                await coroutine
+            return
+        entry = self._chats.get(key)
+        if entry is None:
+            entry = self._chats[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                async with self._workers:
+                    await coroutine
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._chats[key]
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+class BoundedUpdateQueue(asyncio.Queue):
+    """update_queue: put() dan task_done() gacha (ishlov tugaguncha) bitta o'rin band qilinadi.
+
+    O'rinlar tugasa put() kutadi – polling keyingi getUpdates ni, webhook esa javobni kechiktiradi.
+    """
+
+    def __init__(self, max_pending: int):
+        super().__init__()
+        self._slots = asyncio.Semaphore(max_pending)
+
+    async def put(self, item):
+        await self._slots.acquire()
+        super().put_nowait(item)
+
+    def task_done(self):
+        super().task_done()
+        self._slots.release()
+
 # ========== MAIN ==========
+async def poll_updates(application: Application):
+    """Polling rejimida getUpdates ni faqat leader chaqiradi (Telegram bitta pollerga ruxsat beradi)."""
+    await application.updater.start_polling()
+    try:
+        await asyncio.Event().wait()
+    finally:
+        if application.updater.running:
+            await application.updater.stop()
+
 async def run_bot():
     token = os.environ.get("BOT_TOKEN")
     if not token:
         logger.error("BOT_TOKEN topilmadi!")
         return
     await init_db()
-    application = Application.builder().token(token).build()
+    await coordinator.open()
+    await match_cache.warm()
+    await load_league_fixtures()
+    await open_http_session()
+    application = (Application.builder().token(token)
+                   .concurrent_updates(PerChatUpdateProcessor(UPDATE_CONCURRENCY, UPDATE_MAX_PENDING))
+                   .update_queue(BoundedUpdateQueue(UPDATE_MAX_PENDING))
+                   .build())
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("admin", admin_command))
     application.add_handler(CommandHandler("test", test_api))
@@ -1495,14 +3294,61 @@ async def run_bot():
     application.add_handler(CommandHandler("addadmin", add_admin_command))
     application.add_handler(CommandHandler("removeadmin", remove_admin_command))
     application.add_handler(CommandHandler("listadmins", list_admins_command))
+    application.add_handler(CommandHandler("cancel", cancel_broadcast_command))
 
     await application.initialize()
+    # initialize() getMe ni bir marta chaqiradi; keyin bot.username keshdan olinadi
+    logger.info(f"Bot: @{application.bot.username}")
     await application.start()
-    await application.updater.start_polling()
-    logger.info("🤖 Bot ishga tushdi! (Full version with admin menu)")
-    asyncio.create_task(notification_scheduler(application))
-    while True:
-        await asyncio.sleep(3600)
+    global bot_application
+    bot_application = application
+    if WEBHOOK_URL:
+        await application.bot.set_webhook(
+            url=WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH, secret_token=WEBHOOK_SECRET,
+            allowed_updates=Update.ALL_TYPES)
+        logger.info(f"Webhook rejimi: {WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH}")
+    logger.info(f"🤖 Bot ishga tushdi! (Full version with admin menu) worker={WORKER_ID}, coordination={COORDINATION_BACKEND}")
+    # Eslatmalar, outbox, fon ishlari va prefetch faqat leader workerda ishlaydi
+    leader_services = {
+        "outbox": lambda: outbox.run(application.bot),
+        "jobs": job_runner.run,
+        "notification_scheduler": lambda: notification_scheduler(application),
+        "league_prefetcher": league_prefetcher,
+        "match_refresher": match_refresher,
+    }
+    if not WEBHOOK_URL:
+        leader_services["polling"] = lambda: poll_updates(application)
+    services = {
+        "db_writer": db_writer.run,
+        "coordinator_events": coordinator.run_events,
+        "leader": lambda: coordinator.lead(leader_services),
+    }
+    background_tasks = [asyncio.create_task(supervised(name, factory)) for name, factory in services.items()]
+
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:
+            pass
+    try:
+        await stop_event.wait()
+    finally:
+        logger.info("Bot to'xtatilmoqda...")
+        await job_runner.drain()
+        await cancel_broadcast_jobs()
+        for task in background_tasks:
+            task.cancel()
+        await asyncio.gather(*background_tasks, return_exceptions=True)
+        if application.updater.running:
+            await application.updater.stop()
+        await application.stop()
+        await application.shutdown()
+        await close_http_session()
+        await coordinator.close()
+        await db_writer.flush()
+        await db_pool.close()
 
 async def main():
     await asyncio.gather(run_web_server(), run_bot())
@@ -0,0 +1,48 @@
+import asyncio
+from collections import OrderedDict
+
+import bot
+
+
+def test_expired_match_view_is_rebuilt(monkeypatch):
+    clock = [1_000_000.0]
+    fetches = []
+
+    async def fake_api_call(url, headers, params=None, priority=None):
+        fetches.append(url)
+        status = "TIMED" if len(fetches) == 1 else "FINISHED"
+        return {"success": {"id": 7, "status": status, "utcDate": "2026-10-20T12:00:00Z",
+                            "homeTeam": {"name": "A"}, "awayTeam": {"name": "B"}}}
+
+    async def no_analysis(mid):
+        return None
+
+    async def no_buttons(mid):
+        return []
+
+    async def no_l2(self, match_id):
+        return None
+
+    monkeypatch.setattr(bot.time, "time", lambda: clock[0])
+    monkeypatch.setattr(bot, "rate_limited_api_call", fake_api_call)
+    monkeypatch.setattr(bot, "get_analysis", no_analysis)
+    monkeypatch.setattr(bot, "get_match_buttons", no_buttons)
+    monkeypatch.setattr(bot.MatchCache, "_load_l2", no_l2)
+    monkeypatch.setattr(bot, "match_cache", bot.MatchCache())
+    monkeypatch.setattr(bot, "match_views", OrderedDict())
+    monkeypatch.setattr(bot.db_writer, "add_nowait", lambda sql, params: None)
+    monkeypatch.setattr(bot.coordinator, "publish", lambda channel, payload: None)
+
+    async def scenario():
+        first = await bot.get_match_view(7)
+        assert await bot.get_match_view(7) is first
+        assert len(fetches) == 1
+
+        clock[0] += 7 * 24 * 3600
+        second = await bot.get_match_view(7)
+        assert second is not first
+        assert len(fetches) == 2
+        assert bot.match_views[7] is second
+        assert second.expires_at > clock[0]
+
+    asyncio.run(scenario())
@@ -0,0 +1,40 @@
+import asyncio
+from types import SimpleNamespace
+
+import bot
+
+
+class StubBot:
+    username = "litebot_test_bot"
+
+    def __init__(self):
+        self.get_me_calls = 0
+
+    async def get_me(self):
+        self.get_me_calls += 1
+        return SimpleNamespace(username=self.username)
+
+
+class StubMessage:
+    def __init__(self):
+        self.replies = []
+
+    async def reply_text(self, text, **kwargs):
+        self.replies.append(text)
+
+
+def test_start_does_not_call_get_me(monkeypatch):
+    async def noop(*args, **kwargs):
+        return None
+
+    monkeypatch.setattr(bot, "get_or_create_user", noop)
+    monkeypatch.setattr(bot, "schedule_aisports_bonus", noop)
+    stub_bot = StubBot()
+    message = StubMessage()
+    update = SimpleNamespace(effective_user=SimpleNamespace(id=42, first_name="Ali"), message=message)
+    context = SimpleNamespace(args=[], bot=stub_bot)
+
+    asyncio.run(bot.start(update, context))
+
+    assert stub_bot.get_me_calls == 0
+    assert "https://t.me/litebot_test_bot?start=ref_42" in message.replies[0]